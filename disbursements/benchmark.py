@@ -0,0 +1,312 @@
+#! /usr/bin/env python3
+
+"""
+Benchmark the pipeline on synthetic Disbursements data.
+
+Each stage of the pipeline (ingest, derived columns, aggregation and,
+optionally, rendering) is timed on deterministic synthetic data of each of
+the requested sizes, for example:
+
+    ./benchmark.py --scale small medium --output bench.json
+    ./benchmark.py --scale large --only ingest aggregate
+    ./benchmark.py --rows 1000000 --render
+
+Everything is written to a temporary directory, so neither data/ nor
+output/ is touched. Results are written as JSON.
+"""
+
+import argparse
+from collections import namedtuple
+import datetime
+import json
+import os
+import os.path as path
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from utils import synthetic
+from utils.cube import ExpenditureCube
+from utils.out_of_core import PartitionedFrame
+from utils.df_tools import make_year_col, tidy_pds, total_from_pds
+from utils.prepared import DisbursementsFrame
+from utils.read_data import (accdb2pkl, load_pkl_accdb, load_table,
+                             stream_table)
+
+# Columns of the Disbursements table read by the reports
+COLUMNS = ['Parish_Name', 'Primary_category', 'Standardized_Category',
+           'Date', 'Pounds', 'Shillings', 'Pence']
+
+# Category (and its entries) benchmarked by plot.make
+CATEGORY = 'Standardized_Category'
+
+# Synthetic dataset a benchmark is run on, and where its files are kept
+Dataset = namedtuple('Dataset', ['scale', 'rows', 'shape', 'work_dir'])
+
+
+def __ingest_sqlite(dataset, state):
+    db = path.join(dataset.work_dir, 'disbursements.sqlite')
+    return lambda: accdb2pkl(db, cache_dir=path.join(dataset.work_dir,
+                                                     'cache_sqlite'))
+
+
+def __ingest_csv(dataset, state):
+    csv_dir = path.join(dataset.work_dir, 'disbursements_csv')
+    return lambda: accdb2pkl(csv_dir, cache_dir=path.join(dataset.work_dir,
+                                                          'cache_csv'))
+
+
+def __load_all(dataset, state):
+    return lambda: load_pkl_accdb(**__cache(dataset))
+
+
+def __load_columns(dataset, state):
+    return lambda: load_table('Disbursements', COLUMNS, **__cache(dataset))
+
+
+def __load_partitioned(dataset, state):
+    return lambda: PartitionedFrame(stream_table('Disbursements', COLUMNS,
+                                                 **__cache(dataset)))
+
+
+def __make_year_col(dataset, state):
+    return lambda: make_year_col(state['data'])
+
+
+def __total_from_pds(dataset, state):
+    return lambda: total_from_pds(state['data'])
+
+
+def __tidy_pds(dataset, state):
+    return lambda: tidy_pds(state['data'])
+
+
+def __prepare(dataset, state):
+    return lambda: DisbursementsFrame(state['data'])
+
+
+def __annual_total(dataset, state, render=False):
+    import plot.standards
+
+    return lambda: plot.standards.annual_total(state['prepared'], render)
+
+
+def __primary_categories(dataset, state, render=False):
+    import plot.standards
+
+    return lambda: plot.standards.primary_categories(state['prepared'],
+                                                     render)
+
+
+def __cube(dataset, state):
+    return lambda: ExpenditureCube(state['prepared'], CATEGORY).cube
+
+
+def __custom_many(dataset, state, render=False):
+    import plot.make
+
+    return lambda: plot.make.custom_many(state['prepared'], CATEGORY,
+                                         synthetic.STANDARDIZED_CATEGORIES,
+                                         render=render)
+
+
+def __render_annual_total(dataset, state):
+    return __annual_total(dataset, state, render=True)
+
+
+def __render_primary_categories(dataset, state):
+    return __primary_categories(dataset, state, render=True)
+
+
+def __render_custom_many(dataset, state):
+    return __custom_many(dataset, state, render=True)
+
+
+# Benchmarks in the order they are run. Each returns the function to time.
+BENCHMARKS = [('ingest.sqlite', __ingest_sqlite),
+              ('ingest.csv', __ingest_csv),
+              ('load.all', __load_all),
+              ('load.columns', __load_columns),
+              ('load.partitioned', __load_partitioned),
+              ('derived.make_year_col', __make_year_col),
+              ('derived.total_from_pds', __total_from_pds),
+              ('derived.tidy_pds', __tidy_pds),
+              ('derived.prepare', __prepare),
+              ('aggregate.annual_total', __annual_total),
+              ('aggregate.primary_categories', __primary_categories),
+              ('aggregate.cube', __cube),
+              ('aggregate.custom_many', __custom_many),
+              ('render.annual_total', __render_annual_total),
+              ('render.primary_categories', __render_primary_categories),
+              ('render.custom_many', __render_custom_many)]
+
+
+def __cache(dataset):
+    """Arguments locating the cache written by the sqlite ingest."""
+    return {'file_path': path.join(dataset.work_dir, 'disbursements.sqlite'),
+            'cache_dir': path.join(dataset.work_dir, 'cache_sqlite')}
+
+
+def __load(dataset):
+    """Load the Disbursements, ingesting them first if not yet cached."""
+    if not path.exists(__cache(dataset)['cache_dir']):
+        accdb2pkl(**__cache(dataset))
+
+    return load_table('Disbursements', COLUMNS, **__cache(dataset))
+
+
+def __selected(name, only, render):
+    """Whether the benchmark called name is to be run."""
+    if name.startswith('render.') and not render:
+        return False
+
+    return not only or any(name == stage or name.startswith(stage + '.')
+                           for stage in only)
+
+
+def time_fn(fn, repeat):
+    """Time repeat calls of fn, returning the time of each in seconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    return times
+
+
+def prepare(scale, rows, shape, work_dir, seed=0):
+    """Write a synthetic database (and CSV export) of rows rows to work_dir."""
+    dataset = Dataset(scale, rows, shape, work_dir)
+
+    synthetic.write_sqlite(path.join(work_dir, 'disbursements.sqlite'),
+                           rows, seed=seed, **shape)
+    synthetic.write_csv(path.join(work_dir, 'disbursements_csv'),
+                        rows, seed=seed, **shape)
+
+    return dataset
+
+
+def run_dataset(dataset, repeat=3, only=None, render=False):
+    """Run the selected benchmarks on dataset and return their results."""
+    # Shared by the benchmarks: the Disbursements once they are loaded
+    state = {}
+    results = []
+
+    for name, benchmark in BENCHMARKS:
+        if not __selected(name, only, render):
+            continue
+
+        # Stages after loading run on the loaded Disbursements, and
+        # aggregations on them prepared as by run_me.py
+        if name.split('.')[0] not in ('ingest', 'load') and 'data' not in state:
+            state['data'] = __load(dataset)
+            state['prepared'] = DisbursementsFrame(state['data'])
+
+        print('{} ({} rows): {}'.format(dataset.scale, dataset.rows, name))
+
+        # Render every plot, however many times it is benchmarked
+        if name.startswith('render.'):
+            from plot import render_cache
+
+            render_cache.ENABLED = False
+
+        times = time_fn(benchmark(dataset, state), repeat)
+
+        results.append(dict(benchmark=name,
+                            scale=dataset.scale,
+                            rows=dataset.rows,
+                            repeat=repeat,
+                            best=min(times),
+                            mean=sum(times) / len(times),
+                            times=times,
+                            **dataset.shape))
+
+    return results
+
+
+def meta():
+    """Describe the machine and software the benchmarks were run with."""
+    return {'timestamp': datetime.datetime.now().isoformat(),
+            'python': sys.version.split()[0],
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count()}
+
+
+def parse_args(argv=None):
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--scale', nargs='+', default=['small'],
+                        choices=list(synthetic.SCALES),
+                        help="sizes of synthetic dataset to benchmark; "
+                             "see utils/synthetic.py")
+    parser.add_argument('--rows', type=int, nargs='+', default=[],
+                        help="also benchmark datasets of these numbers of "
+                             "rows, spread over --parishes parishes, "
+                             "--years years and --categories categories")
+    parser.add_argument('--parishes', type=int, default=100)
+    parser.add_argument('--years', type=int, default=150)
+    parser.add_argument('--categories', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="times to run each benchmark; the best and "
+                             "mean are reported")
+    parser.add_argument('--only', nargs='+',
+                        help="run only these benchmarks or stages, "
+                             "e.g. ingest or aggregate.cube")
+    parser.add_argument('--render', action='store_true',
+                        help="also benchmark rendering the plots")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="seed of the synthetic data")
+    parser.add_argument('--output', default='benchmark.json',
+                        help="file to write the results to")
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    output = path.realpath(args.output)
+
+    # Datasets to benchmark: named scales, then custom numbers of rows
+    datasets = []
+    for scale in args.scale:
+        parishes, years, categories, rows = synthetic.SCALES[scale]
+        datasets.append((scale, rows, dict(parishes=parishes,
+                                           years=years,
+                                           categories=categories)))
+    for rows in args.rows:
+        datasets.append(('custom', rows, dict(parishes=args.parishes,
+                                              years=args.years,
+                                              categories=args.categories)))
+
+    results = []
+    cwd = os.getcwd()
+    for scale, rows, shape in datasets:
+        work_dir = tempfile.mkdtemp(prefix='benchmark_')
+
+        # Reports write their output/ relative to the working directory
+        os.chdir(work_dir)
+        try:
+            dataset = prepare(scale, rows, shape, work_dir, args.seed)
+            results += run_dataset(dataset, args.repeat, args.only,
+                                   args.render)
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(output, 'w') as f:
+        json.dump({'meta': meta(), 'results': results}, f, indent=2)
+
+    print('Results written to {}'.format(output))
+
+
+if __name__ == "__main__":
+    main()
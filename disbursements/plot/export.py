@@ -0,0 +1,228 @@
+"""
+Export summary tables in several formats at once.
+
+Every table tabulated by plot.standards and plot.make is passed once to
+write_table(), which splits its totals into pounds, shillings and pence a
+single time and writes the result in each of FORMATS:
+
+    txt      the fixed-width text layout tables have always been written in
+    csv      comma separated values
+    parquet  a parquet file (requires pyarrow)
+    xlsx     an Excel workbook (requires openpyxl)
+
+If COMBINED is set, every table is also streamed into one combined output
+as it is written: a workbook with a sheet per table (.xlsx), or a single
+long table (.csv or .parquet) with a Table column naming the table each row
+is from. close() finishes the combined output.
+
+FORMATS and COMBINED default to the environment variables EXPORT_FORMATS
+(comma separated, by default txt) and EXPORT_COMBINED.
+"""
+
+import os
+import os.path as path
+
+import pandas as pd
+
+from utils.money import to_pds
+
+FORMATS = os.environ.get('EXPORT_FORMATS', 'txt').split(',')
+
+# Path of the combined output, if any
+COMBINED = os.environ.get('EXPORT_COMBINED') or None
+
+# Writer of the combined output, opened by the first table written
+__combined = None
+
+
+def write_table(total, save_dir, name):
+    """Write the lsd Series total to save_dir as name.<format> per format."""
+    pds = to_pds(total)
+    columns = None
+
+    for fmt in FORMATS:
+        file_path = path.join(save_dir, '{}.{}'.format(name, fmt))
+
+        if fmt == 'txt':
+            # Legacy layout, unchanged
+            with open(file_path, 'w') as f:
+                f.write(pds.to_string())
+            continue
+
+        if columns is None:
+            columns = __columns(pds, total)
+        __WRITERS[fmt](file_path, columns)
+
+    if COMBINED:
+        if columns is None:
+            columns = __columns(pds, total)
+        __combined_writer().write(name, columns)
+
+
+def close():
+    """Finish the combined output, if any was written."""
+    global __combined
+
+    if __combined is not None:
+        __combined.close()
+        print('Combined tables written to {}'.format(COMBINED))
+        __combined = None
+
+
+def __columns(pds, total):
+    """pds with its index as columns, plus the total in pence."""
+    return pds.assign(Total_pence=total.array.pence).reset_index()
+
+
+def __write_csv(file_path, df):
+    df.to_csv(file_path, index=False)
+
+
+def __write_parquet(file_path, df):
+    df.to_parquet(file_path, index=False)
+
+
+def __write_xlsx(file_path, df):
+    workbook = WorkbookWriter(file_path)
+    workbook.write(path.splitext(path.basename(file_path))[0], df)
+    workbook.close()
+
+
+__WRITERS = {'csv': __write_csv,
+             'parquet': __write_parquet,
+             'xlsx': __write_xlsx}
+
+
+def __combined_writer():
+    """Open the combined output, the first time a table is written."""
+    global __combined
+
+    if __combined is None:
+        writers = {'.csv': LongCSVWriter,
+                   '.parquet': LongParquetWriter,
+                   '.xlsx': WorkbookWriter}
+        ext = path.splitext(COMBINED)[1]
+
+        assert ext in writers, \
+            "Combined output must be .csv, .parquet or .xlsx, not '{}'".format(
+                COMBINED)
+
+        __combined = writers[ext](COMBINED)
+
+    return __combined
+
+
+def long_table(name, df):
+    """df in the long layout of combined output.
+
+    The first index column is kept as Parish_Name and the rest are joined
+    into a single Key column (e.g. the year or category), so that tables
+    with different keys share the same columns.
+    """
+    keys = [col for col in df.columns
+            if col not in ['Pounds', 'Shillings', 'Pence', 'Total_pence']]
+
+    key = pd.Series('', index=df.index)
+    for col in keys[1:]:
+        key = (key + ' ' if col != keys[1] else key) + df[col].astype(str)
+
+    return pd.DataFrame({'Table': name,
+                         'Parish_Name': df[keys[0]].astype(str),
+                         'Key': key,
+                         'Pounds': df['Pounds'].astype('int64'),
+                         'Shillings': df['Shillings'].astype('int64'),
+                         'Pence': df['Pence'].astype('int64'),
+                         'Total_pence': df['Total_pence'].astype('int64')})
+
+
+class LongCSVWriter:
+    """Append tables, in the long layout, to a single CSV file."""
+
+    def __init__(self, file_path):
+        self.__file = open(file_path, 'w', newline='')
+        self.__header = True
+
+    def write(self, name, df):
+        long_table(name, df).to_csv(self.__file, index=False,
+                                    header=self.__header)
+        self.__header = False
+
+    def close(self):
+        self.__file.close()
+
+
+class LongParquetWriter:
+    """Append tables, in the long layout, to a single parquet file."""
+
+    def __init__(self, file_path):
+        self.__file_path = file_path
+        self.__writer = None
+
+    def write(self, name, df):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.Table.from_pandas(long_table(name, df),
+                                     preserve_index=False)
+
+        # Each table is written as its own row group
+        if self.__writer is None:
+            self.__writer = pq.ParquetWriter(self.__file_path, table.schema)
+        self.__writer.write_table(table)
+
+    def close(self):
+        if self.__writer is not None:
+            self.__writer.close()
+
+
+class WorkbookWriter:
+    """Write tables, one sheet each, to an Excel workbook row by row.
+
+    The workbook is written in openpyxl's write-only mode, so rows are
+    streamed to disk rather than held in memory until it is saved.
+    """
+
+    # Longest sheet name Excel allows
+    MAX_SHEET_NAME = 31
+
+    def __init__(self, file_path):
+        from openpyxl import Workbook
+
+        self.__file_path = file_path
+        self.__book = Workbook(write_only=True)
+        self.__sheets = set()
+
+    def write(self, name, df):
+        sheet = self.__book.create_sheet(self.__sheet_name(name))
+        sheet.append(list(df.columns))
+
+        for row in df.itertuples(index=False):
+            sheet.append([self.__cell(value) for value in row])
+
+    def close(self):
+        self.__book.save(self.__file_path)
+
+    def __sheet_name(self, name):
+        """A unique sheet name for name, within Excel's limits."""
+        for char in '[]:*?/\\':
+            name = name.replace(char, ' ')
+
+        sheet_name = name[:self.MAX_SHEET_NAME]
+        suffix = 1
+        while sheet_name in self.__sheets:
+            suffix += 1
+            tag = ' ({})'.format(suffix)
+            sheet_name = name[:self.MAX_SHEET_NAME - len(tag)] + tag
+
+        self.__sheets.add(sheet_name)
+        return sheet_name
+
+    @staticmethod
+    def __cell(value):
+        """value as a type openpyxl can write."""
+        if hasattr(value, 'item'):
+            # numpy scalars
+            return value.item()
+        if pd.isna(value):
+            return None
+        return value
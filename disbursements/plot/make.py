@@ -1,73 +1,99 @@
 """Functions to plot and tabulate expenditure on entry."""
 
-import matplotlib.pyplot as plt
-import os
+from utils.cube import ExpenditureCube
+from utils.instrument import stage, timed
+from plot.export import write_table
+from plot.pretty import output_dir, plot_series
+from plot.scheduler import RenderJob, run_jobs
+
+
+def custom(data, category, entry, cube=None, render=True):
+    """Plot expenditure of entry in category.
+
+    cube is an ExpenditureCube of data over category. Pass the same cube to
+    each call to avoid summing over data again for every entry.
+    """
+    custom_many(data, category, [entry], cube, render)
+
+
+@timed()
+def custom_many(data, category, entries=None, cube=None, render=True):
+    """Plot and tabulate expenditure of each of entries in category.
+
+    The expenditure on every entry (by default every value of category) is
+    computed in one pass, then plotted and tabulated entry by entry. data is
+    a DisbursementsFrame, or the Disbursements to prepare. With
+    render=False the tables are written but nothing is plotted.
+    """
+    if cube is None:
+        with stage('cube'):
+            cube = ExpenditureCube(data, category)
+
+    assert cube.category == category, \
+        "cube is over '{}', not '{}'".format(cube.category, category)
+
+    # Compute expenditure per parish and over all parishes for every entry
+    parish_totals, parish_percents = __compute_expenditure(cube, entries)
+    if render:
+        overall_totals, overall_percents = \
+            __compute_expenditure(cube, entries, by_parish=False)
+
+    if entries is None:
+        entries = list(parish_totals.columns)
+
+    jobs = []
+    for entry in entries:
+        if entry not in parish_totals.columns:
+            print("No expenditure on '{}' found in {}. "
+                  "Skipping.".format(entry, category))
+            continue
+
+        entry_total = parish_totals[entry].dropna().rename('Total')
+
+        # Tabulate expenditure
+        __tabulate_summary(entry_total.to_frame(), entry)
+
+        if not render:
+            continue
+
+        # Plot expenditure per parish
+        jobs += __parish_jobs(entry_total, entry, __plot_total,
+                              '{}_expenditure')
+        jobs += __parish_jobs(parish_percents[entry].dropna(), entry,
+                              __plot_percent, '{}_percent_expenditure')
+
+        # Global plot over summed parishes
+        jobs.append(RenderJob(__plot_overall,
+                              (overall_totals[entry].dropna(), entry),
+                              '{}_expenditure'.format(entry),
+                              'overall',
+                              entry))
+        jobs.append(RenderJob(__plot_overall_percent,
+                              (overall_percents[entry].dropna(), entry),
+                              '{}_percent_expenditure'.format(entry),
+                              'overall',
+                              entry))
+
+    # Render the plots of every entry together
+    if render:
+        run_jobs(jobs)
+
+
+@timed('groupby')
+def __compute_expenditure(cube, entries, by_parish=True):
+    """Compute total and proportional expenditure on each of entries."""
+    # Sum expenditure by year (and parish) from the cube
+    entry_totals = cube.entries(entries, by_parish)
+    data_total = cube.totals(by_parish)
 
-from utils.df_tools import total_from_pds, tidy_pds, make_year_col
-from plot.pretty import make_fig_ax, savefig
-
-
-def custom(data, category, entry):
-    """Plot expenditure of entry in category."""
-    # Plot per parish
-    __custom_parish(data, category, entry)
-
-    # Global plot over summed parishes
-    __custom_total(data, category, entry)
-
-
-def __custom_parish(data, category, entry):
-    """Plot expenditure of entry in category per parish."""
-    # Compute expenditure
-    entry_total, entry_percent = __compute_expenditure(data, category, entry)
-
-    # Plot expenditure
-    __plot_parishes(entry_total.Total, entry, __plot_total)
-    __plot_parishes(entry_percent, entry, __plot_percent)
-
-    # Tabulate expenditure
-    __tabulate_summary(entry_total, entry)
-
-
-def __custom_total(data, category, entry):
-    """Plot expenditure of entry in category over all parishes."""
-    # Compute expenditure
-    entry_total, entry_percent = __compute_expenditure(data, category, entry,
-                                                       by_parish=False)
-
-    __plot_overall(entry_total.Total, entry)
-    __plot_overall_percent(entry_percent, entry)
-
-
-def __compute_expenditure(data, category, entry, by_parish=True):
-    """Compute total and proportional expenditure."""
-    data = data.copy()
-    data = make_year_col(data)
-
-    # Extract entry from category
-    entry_data = data[data[category] == entry]
-
-    # Sum expenditure by year and parish
-    if by_parish:
-        entry_groupby = entry_data.groupby(['Parish_Name', 'Year']).sum()
-        data_groupby = data.groupby(['Parish_Name', 'Year']).sum()
-    else:
-        entry_groupby = entry_data.groupby(['Year']).sum()
-        data_groupby = data.groupby(['Year']).sum()
-
-    # Express expenditure in pence
-    entry_groupby = total_from_pds(entry_groupby)
-    data_groupby = total_from_pds(data_groupby)
-
-    entry_total = entry_groupby.Total
     # Compute expenditure as percentage of total annual expenditure
-    entry_percent = (entry_total / data_groupby.Total).dropna() * 100
+    entry_percents = entry_totals.div(data_total, axis=0) * 100
 
-    return entry_groupby, entry_percent
+    return entry_totals, entry_percents
 
 
-def __plot_overall(data, entry):
-    fig, ax = make_fig_ax()
+def __plot_overall(fig, ax, data, entry):
+    """Plot expenditure on entry over time, summed over parishes."""
     __plot(ax, data)
 
     # Titles and labels
@@ -75,64 +101,44 @@ def __plot_overall(data, entry):
     ax.set_xlabel('Year')
     ax.set_ylabel('Expenditure in pence')
 
-    # Save plot
-    savefig(fig,
-            '{}_expenditure'.format(entry),
-            'overall',
-            entry,
-            bbox_inches='tight')
-
 
-def __plot_overall_percent(data, entry):
-    fig, ax = make_fig_ax()
+def __plot_overall_percent(fig, ax, data, entry):
+    """Plot proportional expenditure on entry over time, summed over parishes."""
     __plot(ax, data)
 
-    # Titles and labels
     # Title and labels
     ax.set_title('Annual {} expenditure as a '
                  'percentage of total expenditure.'.format(entry))
     ax.set_xlabel('Year')
     ax.set_ylabel('Percentage of total expenditure')
 
-    # Save plot
-    savefig(fig,
-            '{}_percent_expenditure'.format(entry),
-            'overall',
-            entry,
-            bbox_inches='tight')
 
+def __parish_jobs(data, entry, plot_fn, plot_base):
+    """Make a job applying plot_fn() to each parish detailed in data."""
+    # Split data by parish in a single pass
+    groups = data.groupby(level=0, sort=False, observed=True)
 
-def __plot_parishes(data, entry, plot_fn):
-    """Loop over parishes detailed in data and apply plot_fn()."""
-    # List of parishes detailed in data
-    parishes = data.index.get_level_values(0).unique()
-
-    # Loop over parishes and plot
-    for parish in parishes:
-        fig, ax = make_fig_ax()
-        plot_fn(fig, ax, data, entry, parish)
+    return [RenderJob(plot_fn,
+                      (parish_data.droplevel(0), entry, parish),
+                      plot_base.format(entry),
+                      parish,
+                      entry)
+            for parish, parish_data in groups]
 
 
 def __plot_total(fig, ax, data, entry, parish):
     """Plot expenditure of parish on entry over time."""
-    __plot(ax, data.loc[parish])
+    __plot(ax, data)
 
     # Titles and labels
     ax.set_title('{}: Annual {} expenditure'.format(parish, entry))
     ax.set_xlabel('Year')
     ax.set_ylabel('Expenditure in pence')
 
-    # Save plot
-    savefig(fig,
-            '{}_expenditure'.format(entry),
-            parish,
-            entry,
-            bbox_inches='tight')
-
 
 def __plot_percent(fig, ax, data, entry, parish):
     """Plot proportional expenditure of parish on entry over time."""
-    __plot(ax, data.loc[parish])
+    __plot(ax, data)
 
     # Title and labels
     ax.set_title('{}: Annual {} expenditure as a '
@@ -140,35 +146,20 @@ def __plot_percent(fig, ax, data, entry, parish):
     ax.set_xlabel('Year')
     ax.set_ylabel('Percentage of total expenditure')
 
-    # Save plot
-    savefig(fig,
-            '{}_percent_expenditure'.format(entry),
-            parish,
-            entry,
-            bbox_inches='tight')
-
 
 def __plot(ax, data):
     """Plot parish data over time."""
-    # Line plot of year vs. expenditure
-    ax.plot(data.reset_index().Year, data)
+    years = data.index.get_level_values('Year')
 
-    # Scatter plot of year vs. expenditure
-    ax.scatter(data.reset_index().Year, data)
+    # Line and scatter plot of year vs. expenditure
+    plot_series(ax, years, data)
 
     # Set xlimits
-    ax.set_xlim(data.reset_index().Year.min(),
-                data.reset_index().Year.max())
+    ax.set_xlim(years.min(), years.max())
 
 
+@timed()
 def __tabulate_summary(df, entry):
-    """"Tabulate expenditure detailed in df."""
-    df = tidy_pds(df)
-    table_path = os.path.join('output',
-                              'custom',
-                              entry,
-                              '{}_expenditure.txt'.format(entry))
-
-    with open(table_path, 'w') as f:
-        f.write(df[["Pounds", "Shillings", "Pence"]].to_string())
+    """"Tabulate expenditure detailed in df, in each export format."""
+    write_table(df.Total, output_dir(entry), '{}_expenditure'.format(entry))
 
@@ -1,23 +1,153 @@
 """Standardise plot size and style."""
 
-import matplotlib.pyplot as plt
+import numpy as np
 import os
 import os.path as path
+import threading
 
-plt.rcParams['text.usetex'] = False
+FIGSIZE = [10, 6.18]
 
-# If running under windows use times new roman font
-if os.name == 'nt':
-    plt.rcParams["font.family"] = "Times New Roman"
+# Whether setup_style() has been called
+__styled = False
+
+
+def setup_style():
+    """Apply the plot style. Called only once something is to be rendered.
+
+    matplotlib is imported here rather than at module level so that stages
+    which render nothing never pay for importing it.
+    """
+    global __styled
+    if __styled:
+        return
+    __styled = True
+
+    import matplotlib
+    import matplotlib.style
+
+    matplotlib.rcParams['text.usetex'] = False
+
+    # The seaborn style was renamed in matplotlib 3.6
+    if 'seaborn' in matplotlib.style.available:
+        matplotlib.style.use('seaborn')
+    else:
+        matplotlib.style.use('seaborn-v0_8')
+
+    # If running under windows use times new roman font
+    if os.name == 'nt':
+        matplotlib.rcParams["font.family"] = "Times New Roman"
 
 
 def make_fig_ax():
-    """Create figure and axes instances to plot on."""
-    return plt.subplots(1, 1, figsize=[10, 6.18])
+    """Create figure and axes instances to plot on.
 
+    The figure is drawn on its own Agg canvas and is not registered with
+    pyplot, so it needs no closing and may be used from any thread.
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
 
-def savefig(fig, plot_base, parish, entry=None, **kwargs):
-    """Convenience function for saving plots."""
+    fig = Figure(figsize=FIGSIZE)
+    FigureCanvasAgg(fig)
+    return fig, fig.add_subplot(1, 1, 1)
+
+
+class FigurePool:
+    """Figures reused between plots drawn from the same template.
+
+    A template (e.g. the function drawing a plot) keeps one figure per
+    thread. Plot functions update the artists already on its axes rather
+    than creating new ones, and the layout is computed once per template
+    and size of the text around the axes (tick labels, title and legend)
+    instead of for every plot.
+    """
+
+    def __init__(self):
+        self.__local = threading.local()
+
+    def __state(self):
+        """Figures and layouts of the calling thread."""
+        if not hasattr(self.__local, 'figures'):
+            self.__local.figures = {}
+            self.__local.layouts = {}
+        return self.__local
+
+    def fig_ax(self, template):
+        """Return the figure and axes to draw the next plot of template on."""
+        figures = self.__state().figures
+
+        if template not in figures:
+            figures[template] = make_fig_ax()
+
+        return figures[template]
+
+    def discard(self, template):
+        """Forget the figure of template, e.g. after a plot failed part way."""
+        self.__state().figures.pop(template, None)
+
+    def layout(self, template, fig, ax):
+        """Lay out fig, reusing the layout of earlier plots of template."""
+        layouts = self.__state().layouts
+
+        # Wider tick labels, a longer title or a larger legend (which may be
+        # drawn outside the axes) need wider margins
+        key = (template,
+               self.__label_width(ax.xaxis),
+               self.__label_width(ax.yaxis),
+               len(ax.get_title()),
+               self.__legend_size(ax))
+
+        if key not in layouts:
+            fig.tight_layout()
+            params = fig.subplotpars
+            layouts[key] = {'left': params.left,
+                            'right': params.right,
+                            'bottom': params.bottom,
+                            'top': params.top}
+        else:
+            fig.subplots_adjust(**layouts[key])
+
+    @staticmethod
+    def __label_width(axis):
+        """Number of characters in the widest major tick label of axis."""
+        formatter = axis.get_major_formatter()
+        labels = formatter.format_ticks(axis.get_majorticklocs())
+        return max((len(label) for label in labels), default=0)
+
+    @staticmethod
+    def __legend_size(ax):
+        """Number of entries, and characters in the widest, of ax's legend."""
+        legend = ax.get_legend()
+        if legend is None:
+            return None
+
+        texts = [legend.get_title()] + legend.get_texts()
+        return (len(texts),
+                max(len(text.get_text()) for text in texts))
+
+
+# Figures shared by the plots rendered by this process
+FIGURES = FigurePool()
+
+
+def plot_series(ax, x, y):
+    """Line and scatter plot of y against x, reusing ax's artists if present."""
+    x = np.asarray(x)
+    y = np.asarray(y)
+
+    if ax.lines and ax.collections:
+        # Update the plot drawn for the previous parish
+        ax.lines[0].set_data(x, y)
+        ax.collections[0].set_offsets(np.column_stack([x, y]))
+        ax.relim()
+        ax.autoscale_view()
+    else:
+        ax.plot(x, y)
+        ax.scatter(x, y)
+
+
+def output_dir(entry=None):
+    """Return the directory output for entry is saved to, creating it."""
     save_dir = 'output'
 
     if entry:
@@ -28,12 +158,21 @@ def savefig(fig, plot_base, parish, entry=None, **kwargs):
 
     # Create output directory if it doesn't exist
     if not os.path.exists(save_dir):
-        os.makedirs(save_dir)
+        os.makedirs(save_dir, exist_ok=True)
+
+    return save_dir
+
 
+def figure_path(plot_base, parish, entry=None):
+    """Return the path a plot is saved to."""
     # Construct file name of plot
-    file_name = os.path.join(save_dir,
-                             '{}_{}.png'.format(plot_base, parish))
+    return os.path.join(output_dir(entry),
+                        '{}_{}.png'.format(plot_base, parish))
+
+
+def savefig(fig, plot_base, parish, entry=None, **kwargs):
+    """Convenience function for saving plots."""
+    file_name = figure_path(plot_base, parish, entry)
 
     fig.tight_layout()
     fig.savefig(file_name, format='png', **kwargs)
-    plt.close('all')
@@ -0,0 +1,107 @@
+"""
+Content-addressed cache of rendered plots.
+
+Each plot is keyed by a hash of everything that determines it: the data it
+is drawn from, its name, the code of the module drawing it, and the plot
+style: matplotlib's settings and the code of the modules which size, lay
+out and save every figure. The key is stored next to the plot in a <plot>.sha256 file, and a
+plot whose key is unchanged is not rendered again.
+"""
+
+import functools
+import hashlib
+import inspect
+import os
+
+import pandas as pd
+
+# Set RENDER_CACHE=0 to render every plot regardless of the cache
+ENABLED = os.environ.get('RENDER_CACHE', '1') != '0'
+
+# Modules shared by every plot: the figure size, style and layout
+# (pretty.py) and how figures are saved (scheduler.py)
+STYLE_MODULES = [os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                              name)
+                 for name in ['pretty.py', 'scheduler.py']]
+
+
+def key_path(plot_path):
+    """Return the path the key of the plot at plot_path is stored at."""
+    return plot_path + '.sha256'
+
+
+@functools.lru_cache(maxsize=None)
+def __module_digest(module_file):
+    """Hash the source of the module drawing a plot."""
+    with open(module_file, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def __update(sha, obj):
+    """Feed obj into sha, hashing pandas objects by their contents."""
+    if isinstance(obj, (tuple, list)):
+        for item in obj:
+            __update(sha, item)
+    elif isinstance(obj, (pd.Series, pd.DataFrame)):
+        names = obj.columns if isinstance(obj, pd.DataFrame) else [obj.name]
+        sha.update(repr((list(names),
+                         list(obj.index.names),
+                         str(obj.dtypes))).encode())
+        sha.update(pd.util.hash_pandas_object(obj, index=True).values)
+    else:
+        sha.update(repr(obj).encode())
+
+
+def job_key(job):
+    """Return the hash of everything which determines the plot of job."""
+    import matplotlib
+
+    sha = hashlib.sha256()
+
+    # What is plotted, and what it is called
+    __update(sha, (job.plot_base, job.parish, job.entry))
+    __update(sha, job.args)
+
+    # How it is plotted
+    __update(sha, (job.plot_fn.__module__, job.plot_fn.__qualname__))
+    sha.update(__module_digest(inspect.getsourcefile(job.plot_fn)).encode())
+
+    # The style it is plotted in
+    __update(sha, matplotlib.__version__)
+    __update(sha, sorted((key, repr(value))
+                         for key, value in matplotlib.rcParams.items()
+                         if key != 'backend'))
+    for module_file in STYLE_MODULES:
+        sha.update(__module_digest(module_file).encode())
+
+    return sha.hexdigest()
+
+
+def is_fresh(plot_path, key):
+    """Whether the plot at plot_path exists and was rendered with key."""
+    if not ENABLED or not os.path.isfile(plot_path):
+        return False
+
+    try:
+        with open(key_path(plot_path)) as f:
+            return f.read().strip() == key
+    except FileNotFoundError:
+        return False
+
+
+def invalidate(plot_path):
+    """Forget the key of the plot at plot_path, e.g. before re-rendering it."""
+    try:
+        os.remove(key_path(plot_path))
+    except FileNotFoundError:
+        pass
+
+
+def record(plot_path, key):
+    """Store key as the key of the plot just rendered at plot_path."""
+    tmp_path = key_path(plot_path) + '.tmp'
+
+    with open(tmp_path, 'w') as f:
+        f.write(key + '\n')
+
+    os.replace(tmp_path, key_path(plot_path))
@@ -0,0 +1,156 @@
+"""
+Render plots as independent jobs, optionally on a pool of worker processes.
+
+A RenderJob names a plot function, the (picklable) arguments it is drawn
+from and where the plot is saved. run_jobs() renders a list of jobs, either
+in this process or spread over a process pool, skipping plots which are
+unchanged since they were last rendered (see plot.render_cache), and reports
+every job that failed without stopping the others.
+"""
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import os
+import traceback
+import tracemalloc
+
+from utils import instrument
+from utils.instrument import stage, timed
+from plot import render_cache
+from plot.pretty import FIGURES, figure_path, setup_style
+
+# Outcome of rendering a list of jobs
+RenderReport = namedtuple('RenderReport', ['rebuilt', 'skipped', 'failures'])
+
+# Number of worker processes used to render plots. 1 renders in this process.
+PROCESSES = int(os.environ.get('RENDER_PROCESSES', 1))
+
+
+class RenderJob(namedtuple('RenderJob', ['plot_fn',
+                                         'args',
+                                         'plot_base',
+                                         'parish',
+                                         'entry'])):
+    """A plot to draw with plot_fn(fig, ax, *args) and save.
+
+    The plot is saved as figure_path(plot_base, parish, entry), so a job's
+    output path does not depend on when or where it is rendered.
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, plot_fn, args, plot_base, parish, entry=None):
+        return super().__new__(cls, plot_fn, args, plot_base, parish, entry)
+
+    @property
+    def path(self):
+        return figure_path(self.plot_base, self.parish, self.entry)
+
+
+def render(job):
+    """Render job unless its plot is unchanged since it was last rendered.
+
+    Returns the job's path, whether it was rendered and the traceback if
+    rendering failed.
+    """
+    template = (job.plot_fn.__module__, job.plot_fn.__qualname__)
+
+    try:
+        key = render_cache.job_key(job)
+        if render_cache.is_fresh(job.path, key):
+            return job.path, False, None
+
+        render_cache.invalidate(job.path)
+
+        # Reuse the figure of earlier plots drawn by the same function
+        fig, ax = FIGURES.fig_ax(template)
+        with stage('plot.' + job.plot_fn.__name__.lstrip('_')):
+            job.plot_fn(fig, ax, *job.args)
+        with stage('layout'):
+            FIGURES.layout(template, fig, ax)
+        with stage('savefig'):
+            fig.savefig(job.path, format='png')
+
+        render_cache.record(job.path, key)
+    except Exception:
+        FIGURES.discard(template)
+        return job.path, True, traceback.format_exc()
+
+    return job.path, True, None
+
+
+def __render_recorded(job):
+    """Render job in a worker process, returning the stages it recorded."""
+    return render(job), instrument.drain()
+
+
+def __init_worker(rc_params, tracing):
+    """Give a worker process the plot style of the parent process."""
+    import matplotlib
+
+    matplotlib.rcParams.update(rc_params)
+
+    # Record only the worker's own stages, not those copied from the parent
+    instrument.reset()
+
+    # Trace memory allocations in workers if the parent does
+    instrument.tracing(tracing)
+
+
+def __style():
+    """Return the rcParams of this process which define the plot style."""
+    import matplotlib
+
+    return {key: value for key, value in matplotlib.rcParams.items()
+            if key != 'backend'}
+
+
+@timed('render')
+def run_jobs(jobs, processes=None):
+    """Render jobs, on processes worker processes, and report the outcome.
+
+    Returns a RenderReport of how many plots were rendered and how many
+    were skipped as unchanged. Failures are listed in the report (and
+    printed) as (path, traceback) pairs once every job has been attempted.
+    """
+    if processes is None:
+        processes = PROCESSES
+
+    jobs = list(jobs)
+
+    if jobs:
+        setup_style()
+
+    if processes > 1 and len(jobs) > 1:
+        # Hand each worker a few batches of jobs to keep them all busy
+        chunksize = max(1, len(jobs) // (processes * 4))
+
+        # Workers trace memory allocations if this process does
+        initargs = (__style(), tracemalloc.is_tracing())
+
+        with ProcessPoolExecutor(processes,
+                                 initializer=__init_worker,
+                                 initargs=initargs) as pool:
+            results = []
+            for result, recorded in pool.map(__render_recorded, jobs,
+                                             chunksize=chunksize):
+                results.append(result)
+                instrument.merge(recorded)
+    else:
+        results = [render(job) for job in jobs]
+
+    failures = [(path, error) for path, _, error in results if error]
+    report = RenderReport(
+        rebuilt=sum(rendered and not error for _, rendered, error in results),
+        skipped=sum(not rendered for _, rendered, _ in results),
+        failures=failures)
+
+    print('Rendered {} plots, skipped {} unchanged.'.format(report.rebuilt,
+                                                            report.skipped))
+
+    if failures:
+        print('\n{} of {} plots failed:'.format(len(failures), len(jobs)))
+        for path, error in failures:
+            print('\n{}\n{}'.format(path, error))
+
+    return report
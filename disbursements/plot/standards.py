@@ -1,12 +1,13 @@
 """Functions to plot and summarise disbursements data in various ways."""
 
-import matplotlib.pyplot as plt
-import os
+import numpy as np
+import pandas as pd
 
-from utils.df_tools import total_from_pds, tidy_pds, make_year_col
-from plot.pretty import make_fig_ax, savefig
-
-plt.style.use('seaborn')
+from utils.instrument import stage, timed
+from utils.prepared import prepare
+from plot.export import write_table
+from plot.pretty import output_dir, plot_series
+from plot.scheduler import RenderJob, run_jobs
 
 
 # Ensure categories are represented by the same colour in each plot
@@ -18,54 +19,131 @@ categories = ['Bells',
               'Communion Bread and Wine',
               'Miscellaneous',
               'Parish Administration']
-category_colours = dict(zip(categories, plt.cm.tab10.colors[:len(categories)]))
 
+# Categories outside the top N of a parish are rolled up into this one,
+# along with any category of this name already in the data
+OTHER = 'Other'
+
+
+def category_colours():
+    """Map each category to its colour."""
+    import matplotlib
+
+    colours = dict(zip(categories,
+                       matplotlib.colormaps['tab10'].colors[:len(categories)]))
+    colours[OTHER] = 'lightgrey'
+    return colours
 
-def annual_total(data):
+
+@timed()
+def annual_total(data, render=True):
     """
     Plot and tabulate the total annual expenditure for each parish.
+
+    data is a DisbursementsFrame, or the Disbursements to prepare. With
+    render=False the table is written but nothing is plotted.
     """
-    data = make_year_col(data)
+    data = prepare(data).data
 
     # Sum expenditure over parish and year
-    groupby = data.groupby(['Parish_Name', 'Year']).sum()
-    # Tiday pounds, shillings and pence
-    groupby = total_from_pds(groupby)
+    with stage('groupby'):
+        groupby = data.groupby(['Parish_Name', 'Year'],
+                               observed=True)[['Total']].sum()
 
     # Plot data
-    __plot_parishes(groupby, __annual_total_plot)
+    if render:
+        run_jobs(__parish_jobs(groupby, __annual_total_plot,
+                               'total_expenditure'))
 
     # Tabulate data
-    __tabulate_summary(groupby, 'total_expenditure.txt')
+    __tabulate_summary(groupby, 'total_expenditure')
 
 
-def primary_categories(data):
+@timed()
+def primary_categories(data, render=True, top=None):
     """
     Plot and tabulate total expenditure for each parish, grouping by primary category.
+
+    data is a DisbursementsFrame, or the Disbursements to prepare. With
+    render=False the table is written but nothing is plotted. If top is
+    given, each pie chart shows the top categories of the parish and rolls
+    the rest up into a single 'Other' wedge.
     """
-    # Sum expenditure over parish and category
-    category_spends = data.groupby(['Parish_Name', 'Primary_category']).sum()
+    data = prepare(data).data
 
-    # Tidy up pounds, shillings and pence totals
-    category_spends = total_from_pds(category_spends)
+    # Sum expenditure over parish and category
+    with stage('groupby'):
+        category_spends = data.groupby(['Parish_Name', 'Primary_category'],
+                                       observed=True)[['Total']].sum()
 
     # Sort within groups on total expenditure
-    g = category_spends.groupby(level=0, group_keys=False)
-    category_spends = g.apply(lambda x: x.sort_values(by="Total",
-                                                      ascending=False))
+    with stage('rank'):
+        ranked = rank_categories(category_spends)
 
     # Plot data
-    __plot_parishes(category_spends, __primary_categories_plot)
+    if render:
+        with stage('pie_slices'):
+            slices = pie_slices(ranked, top)
+        run_jobs(__parish_jobs(slices, __primary_categories_plot,
+                               'primary_category'))
 
     # Tabulate data
-    __tabulate_summary(category_spends, 'primary_categories.txt')
+    __tabulate_summary(ranked, 'primary_categories')
+
+
+def rank_categories(category_spends):
+    """Rank the categories of each parish by expenditure, in one pass.
+
+    category_spends holds the Total expenditure keyed by parish and
+    category. Returns it sorted by parish and then by decreasing Total,
+    with each category's Rank (from 1) within the parish.
+    """
+    pence = category_spends['Total'].array.pence
+    parish = category_spends.index.codes[0]
+
+    # A single stable sort: by parish, then by decreasing total
+    order = np.lexsort((-pence, parish))
+    ranked = category_spends.iloc[order]
+    pence = pence[order]
+    parish = parish[order]
+
+    # Positions within each parish, without a Python loop
+    by_parish = pd.Series(pence).groupby(parish)
+
+    return ranked.assign(Rank=by_parish.cumcount().to_numpy() + 1)
+
+
+def pie_slices(ranked, top=None):
+    """Wedges of each parish's pie, in the order they are drawn.
+
+    Categories are drawn in category order. If top is given, categories
+    ranked below the top of their parish are summed into a single 'Other'
+    wedge, drawn last. A category already named 'Other' is summed into
+    that wedge too, rather than drawn as a second wedge of the same name.
+    """
+    if top is None or (ranked['Rank'] <= top).all():
+        return ranked[['Total']].sort_index()
+
+    parish, category = (ranked.index.get_level_values(level)
+                        for level in (0, 1))
+
+    # Relabel every category below the top as Other, drawn last
+    categories = [c for c in category.categories if c != OTHER] + [OTHER]
+    category = pd.Categorical(category, categories=categories)
+    category[ranked['Rank'].to_numpy() > top] = OTHER
+    keys = [parish, pd.CategoricalIndex(category, name=ranked.index.names[1])]
+
+    return ranked['Total'].groupby(keys, observed=True).sum().to_frame()
 
 
 def __primary_categories_plot(fig, ax, data, parish):
     """Produce pie chart of parish spending by primary category."""
-    # Display categories alphatbetically
-    data.sort_index(inplace=True)
-    colors = [category_colours[v] for v in data.loc[parish].index]
+    # Wedges differ between parishes, so start from empty axes
+    ax.clear()
+
+    # Wedges are already in display order (see pie_slices)
+    colours = category_colours()
+    colors = [colours[v] for v in data.loc[parish].index]
     # Plot pie on ax
     patches, texts, autotexts = ax.pie(data.loc[parish, 'Total'],
                                        labels=None,
@@ -81,44 +159,30 @@ def __primary_categories_plot(fig, ax, data, parish):
               bbox_to_anchor=(1, 0, 0.5, 1),
               title="Expenditure by primary category")
 
-    # Save plot
-    savefig(fig, 'primary_category', parish, bbox_inches='tight')
-
 
 def __annual_total_plot(fig, ax, data, parish):
     """Plot total annual expenditure for parish."""
-    # Line plot of year vs. total expenditure
-    ax.plot(data.loc[parish].reset_index().Year,
-            data.loc[parish, 'Total'])
-    # Scatter plot of year vs. total expenditure
-    ax.scatter(data.loc[parish].reset_index().Year,
-            data.loc[parish, 'Total'])
+    # Line and scatter plot of year vs. total expenditure
+    plot_series(ax,
+                data.loc[parish].index.get_level_values('Year'),
+                data.loc[parish, 'Total'])
 
     # Set title and labels
     ax.set_title(parish + ': total annual expenditure')
     ax.set_xlabel('Year')
     ax.set_ylabel('Expenditure in pence')
 
-    # Save plot
-    savefig(fig, 'total_expenditure', parish, bbox_inches='tight')
-
 
+@timed()
 def __tabulate_summary(df, tab_name):
-    """"Tabulate expenditure detailed in df."""
-    df = tidy_pds(df)
-    table_path = os.path.join('output', 'standards', tab_name)
-
-    with open(table_path, 'w') as f:
-        f.write(df[["Pounds", "Shillings", "Pence"]].to_string())
-
+    """"Tabulate expenditure detailed in df, in each export format."""
+    write_table(df.Total, output_dir(), tab_name)
 
-def __plot_parishes(data, plot_fn):
-    """Loop over parishes detailed in data and apply plot_fn()."""
-    # List of parishes detailed in data
-    parishes = data.index.get_level_values(0).unique()
 
-    # Loop over parishes and plot
-    for parish in parishes:
-        fig, ax = make_fig_ax()
-        plot_fn(fig, ax, data, parish)
+def __parish_jobs(data, plot_fn, plot_base):
+    """Make a job applying plot_fn() to each parish detailed in data."""
+    # Split data by parish in a single pass
+    groups = data.groupby(level=0, sort=False, observed=True)
 
+    return [RenderJob(plot_fn, (parish_data, parish), plot_base, parish)
+            for parish, parish_data in groups]
@@ -1,24 +1,332 @@
 #! /usr/bin/env python3
 
-"""Run this script to generate all outputs for latest data."""
+"""
+Run this script to generate all outputs for latest data.
 
-from utils.read_data import accdb2pkl
-import plot.make
-import plot.standards
+Stages may also be run on their own, for example:
 
+    ./run_me.py ingest --incremental
+    ./run_me.py --source north.accdb --source south.accdb ingest
+    ./run_me.py standards
+    ./run_me.py custom Funeral Sermons
+    ./run_me.py tables-only
+    ./run_me.py --out-of-core tables-only
+    ./run_me.py reconcile
 
-def main():
-    accdb = accdb2pkl()
+See ./run_me.py --help. Each stage imports only the modules it needs, so
+stages which plot nothing never import matplotlib.
 
-    data = accdb["Disbursements"]
+The time and memory used by each stage (and the steps within it) are
+recorded, and written as a JSON or CSV report with --report (or
+RUN_REPORT=<path>). --profile (or RUN_PROFILE=<path>) dumps a cProfile of
+the run.
+"""
 
-    plot.standards.primary_categories(data)
-    plot.standards.annual_total(data)
+import argparse
+import datetime
+import os
+import sys
 
-    plot.make.custom(data, 'Standardized_Category', 'Funeral')
-    plot.make.custom(data, 'Standardized_Category', 'Perambulation')
-    plot.make.custom(data, 'Standardized_Category', 'Book of Common Prayer')
-    plot.make.custom(data, 'Standardized_Category', 'Sermons')
+from utils.instrument import profiled, stage, tracing, write_report
+
+# Entries to plot and tabulate expenditure on, by category. Use None in
+# place of a list to report on every entry in the category.
+CUSTOM_ENTRIES = {
+    'Standardized_Category': ['Funeral',
+                              'Perambulation',
+                              'Book of Common Prayer',
+                              'Sermons'],
+}
+
+# Columns of the Disbursements table read by every report
+COLUMNS = ['Parish_Name', 'Date', 'Pounds', 'Shillings', 'Pence']
+
+
+def ingest(args):
+    """Read the database into the cache and return the Disbursements."""
+    from utils.read_data import accdb2pkl
+
+    with stage('ingest'):
+        accdb = accdb2pkl(args.source,
+                          incremental=args.incremental,
+                          changed=args.changed,
+                          processes=args.ingest_processes)
+
+    return accdb["Disbursements"]
+
+
+def load(args, columns):
+    """Load the columns reports need from the cached Disbursements."""
+    from utils.read_data import load_table
+
+    columns = list(dict.fromkeys(COLUMNS + columns))
+
+    if args.out_of_core:
+        return load_partitioned(args, columns)
+
+    with stage('load'):
+        data = load_table("Disbursements", columns=columns,
+                          file_path=args.source)
+
+    return prepare(data)
+
+
+def load_partitioned(args, columns):
+    """Sum the cached Disbursements a partition at a time, for reports."""
+    from utils.out_of_core import PARTITION_ROWS, PartitionedFrame
+    from utils.read_data import stream_table
+
+    rows = args.partition_rows or PARTITION_ROWS
+
+    with stage('load'):
+        partitions = stream_table("Disbursements", columns=columns,
+                                  file_path=args.source, rows=rows)
+        return PartitionedFrame(partitions, rows)
+
+
+def prepare(data):
+    """Derive the columns every report reads from the Disbursements, once."""
+    from utils.prepared import DisbursementsFrame
+
+    return DisbursementsFrame(data)
+
+
+def standards(args, data, render=True):
+    """Plot and tabulate the standard summaries."""
+    if render:
+        __set_processes(args)
+
+    with stage('standards'):
+        import plot.standards
+
+        plot.standards.primary_categories(data, render, top=args.top)
+        plot.standards.annual_total(data, render)
+
+
+def custom(args, data, entries, render=True):
+    """Plot and tabulate expenditure on entries, keyed by category."""
+    if render:
+        __set_processes(args)
+
+    with stage('custom'):
+        import plot.make
+
+        # Plot and tabulate every entry of a category in one pass
+        for category, category_entries in entries.items():
+            plot.make.custom_many(data, category, category_entries,
+                                  render=render)
+
+
+def reconciliation(args):
+    """Reconcile each parish and year against the recorded totals."""
+    import os.path as path
+
+    from utils.read_data import load_pkl_accdb
+    from utils.reconcile import (ITEMISED, RECORDED, as_lsd, discrepancies,
+                                 reconcile)
+
+    tables = list(ITEMISED.values()) + list(RECORDED.values())
+
+    # Only the Disbursements are large enough to be worth restricting
+    with stage('load'):
+        data = load_pkl_accdb(tables=tables,
+                              columns={'Disbursements': COLUMNS},
+                              file_path=args.source)
+
+    with stage('reconcile'):
+        accounts = reconcile(data, args.tolerance, args.carry_forward)
+        failed = discrepancies(accounts)
+
+    save_dir = path.join('output', 'reconciliation')
+    os.makedirs(save_dir, exist_ok=True)
+
+    # Amounts in pence for loading elsewhere, and as £sd for reading
+    accounts.to_csv(path.join(save_dir, 'accounts.csv'))
+    failed.to_csv(path.join(save_dir, 'discrepancies.csv'))
+    with open(path.join(save_dir, 'discrepancies.txt'), 'w') as f:
+        f.write(as_lsd(failed).to_string())
+
+    print('{} of {} parish years failed to reconcile. '
+          'See {}.'.format(len(failed), len(accounts), save_dir))
+
+
+def __set_processes(args):
+    """Set the number of processes plots are rendered on."""
+    if args.processes:
+        import plot.scheduler
+
+        plot.scheduler.PROCESSES = args.processes
+
+
+def __set_export(args):
+    """Set the formats tables are exported in."""
+    import plot.export
+
+    if args.formats:
+        plot.export.FORMATS = args.formats
+    if args.combined:
+        plot.export.COMBINED = args.combined
+
+
+def run_all(args):
+    data = ingest(args)
+
+    if args.out_of_core:
+        # Reports read the cache just written, a partition at a time
+        del data
+        data = load(args, ['Primary_category'] + list(CUSTOM_ENTRIES))
+    else:
+        data = prepare(data)
+
+    standards(args, data)
+    custom(args, data, CUSTOM_ENTRIES)
+
+
+def run_ingest(args):
+    ingest(args)
+
+
+def run_standards(args):
+    data = load(args, ['Primary_category'])
+    standards(args, data, render=not args.tables_only)
+
+
+def run_custom(args):
+    # Entries given on the command line, else those configured above
+    entries = args.entries or CUSTOM_ENTRIES.get(args.category)
+    data = load(args, [args.category])
+    custom(args, data, {args.category: entries},
+           render=not args.tables_only)
+
+
+def run_reconcile(args):
+    reconciliation(args)
+
+
+def run_tables_only(args):
+    data = load(args, ['Primary_category'] + list(CUSTOM_ENTRIES))
+    standards(args, data, render=False)
+    custom(args, data, CUSTOM_ENTRIES, render=False)
+
+
+def parse_args(argv=None):
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--source', action='append',
+                        help="database (or directory of CSV exports) to "
+                             "read, repeated to merge several; by default "
+                             "the database in data/")
+    parser.add_argument('--processes', type=int,
+                        help="number of processes to render plots on")
+    parser.add_argument('--ingest-processes', type=int,
+                        help="number of processes to read several "
+                             "databases on; by default one per CPU")
+    parser.add_argument('--out-of-core', action='store_true',
+                        help="sum the cached Disbursements a partition at "
+                             "a time, for tables too large for memory")
+    parser.add_argument('--partition-rows', type=int,
+                        help="rows per partition with --out-of-core; by "
+                             "default PARTITION_ROWS or 1000000")
+    parser.add_argument('--report',
+                        default=os.environ.get('RUN_REPORT'),
+                        help="write the time and memory used by each stage "
+                             "to this file, as CSV if it ends .csv else "
+                             "as JSON")
+    parser.add_argument('--profile',
+                        default=os.environ.get('RUN_PROFILE'),
+                        help="dump a cProfile of the run to this file")
+    parser.add_argument('--tracemalloc', action='store_true', default=None,
+                        help="record the peak memory allocated by each "
+                             "stage (slow); or set RUN_TRACEMALLOC=1")
+    parser.add_argument('--formats', nargs='+',
+                        choices=['txt', 'csv', 'parquet', 'xlsx'],
+                        help="formats to write tables in; by default txt, "
+                             "or as listed in EXPORT_FORMATS")
+    parser.add_argument('--combined',
+                        help="also write every table to this one .xlsx "
+                             "workbook, or .csv or .parquet file")
+    parser.set_defaults(run=run_all, incremental=False, changed=None,
+                        top=None)
+
+    stages = parser.add_subparsers(title='stages',
+                                   description="by default every stage "
+                                               "is run")
+
+    stage = stages.add_parser('all', help="ingest, then every report")
+    stage.set_defaults(run=run_all)
+    stage.add_argument('--incremental', action='store_true',
+                       help="only read rows added since the last ingest")
+    stage.add_argument('--changed',
+                       help="column marking when a row last changed")
+
+    stage = stages.add_parser('ingest',
+                              help="read the database into the cache")
+    stage.set_defaults(run=run_ingest)
+    stage.add_argument('--incremental', action='store_true',
+                       help="only read rows added since the last ingest")
+    stage.add_argument('--changed',
+                       help="column marking when a row last changed")
+
+    stage = stages.add_parser('standards',
+                              help="standard summaries, from the cache")
+    stage.set_defaults(run=run_standards)
+    stage.add_argument('--tables-only', action='store_true',
+                       help="write tables without plotting")
+    stage.add_argument('--top', type=int,
+                       help="show only the top TOP primary categories of "
+                            "each parish, and the rest as Other")
+
+    stage = stages.add_parser('custom',
+                              help="expenditure on entries, from the cache")
+    stage.set_defaults(run=run_custom)
+    stage.add_argument('entries', nargs='*',
+                       help="entries to report on; by default those "
+                            "configured in CUSTOM_ENTRIES")
+    stage.add_argument('--category', default='Standardized_Category',
+                       help="column the entries are values of")
+    stage.add_argument('--tables-only', action='store_true',
+                       help="write tables without plotting")
+
+    stage = stages.add_parser('reconcile',
+                              help="reconcile receipts, disbursements and "
+                                   "remains with the recorded totals, "
+                                   "from the cache")
+    stage.set_defaults(run=run_reconcile)
+    stage.add_argument('--tolerance', type=int, default=0,
+                       help="pence a total may differ by and reconcile")
+    stage.add_argument('--carry-forward', action='store_true',
+                       help="add each year's recorded remains to the "
+                            "next year's receipts")
+
+    stage = stages.add_parser('tables-only',
+                              help="every table, from the cache, "
+                                   "without plotting")
+    stage.set_defaults(run=run_tables_only)
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    tracing(args.tracemalloc)
+    started = datetime.datetime.now()
+
+    __set_export(args)
+
+    try:
+        with profiled(args.profile):
+            args.run(args)
+    finally:
+        import plot.export
+
+        # Finish the combined workbook or dataset of every table
+        plot.export.close()
+
+        if args.report:
+            write_report(args.report,
+                         {'argv': sys.argv if argv is None else argv,
+                          'started': started.isoformat(),
+                          'finished': datetime.datetime.now().isoformat()})
 
 
 if __name__ == "__main__":
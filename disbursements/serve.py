@@ -0,0 +1,149 @@
+#! /usr/bin/env python3
+
+"""
+Serve queries about expenditure over HTTP, as JSON.
+
+The cached Disbursements are loaded and indexed once (see utils/query.py),
+after which each query is answered in milliseconds. Run ingest first (see
+./run_me.py ingest), then for example:
+
+    ./serve.py --port 8000
+    curl 'localhost:8000/spend?parish=Whickham&from=1650&to=1700&Standardized_Category=Funeral'
+    curl 'localhost:8000/values?column=Primary_category'
+
+/spend sums expenditure in a parish (by default every parish) between two
+years (by default every year), optionally only on the given value of
+Primary_category and/or Standardized_Category, and compares it with the
+total expenditure over the same parish and years. /values lists the values
+a column may be queried on, and /stats reports on the response cache.
+
+Responses are cached, the least recently used being evicted first.
+"""
+
+import argparse
+import functools
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+# Columns of the Disbursements table which are indexed
+COLUMNS = ['Parish_Name', 'Date', 'Pounds', 'Shillings', 'Pence',
+           'Primary_category', 'Standardized_Category']
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """Answer GET requests from the server's respond() function."""
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+
+        try:
+            params = tuple(sorted(parse_qsl(url.query)))
+            status, body = self.server.respond(url.path, params)
+        except Exception as error:
+            status, body = 500, json.dumps({'error': str(error)}).encode()
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def responder(index, cache_size=1024):
+    """Return a function answering (path, params) requests from index.
+
+    Responses are cached as encoded JSON, keyed by the path and sorted
+    query parameters, with least recently used eviction.
+    """
+    @functools.lru_cache(maxsize=cache_size)
+    def answer(path, params):
+        params = dict(params)
+
+        try:
+            if path == '/spend':
+                body = __spend(index, params)
+            elif path == '/values':
+                body = index.values(params['column'])
+            else:
+                return 404, __error('No such query: {}'.format(path))
+        except (AssertionError, KeyError, ValueError) as error:
+            return 400, __error(error)
+
+        return 200, json.dumps(body).encode()
+
+    def respond(path, params):
+        # Statistics of the cache itself are never cached
+        if path == '/stats':
+            return 200, json.dumps(answer.cache_info()._asdict()).encode()
+
+        return answer(path, params)
+
+    return respond
+
+
+def __error(message):
+    """Encode an error response."""
+    return json.dumps({'error': str(message)}).encode()
+
+
+def __spend(index, params):
+    """Answer a /spend query."""
+    parish = params.pop('parish', None)
+    year_from = params.pop('from', None)
+    year_to = params.pop('to', None)
+
+    return index.query(parish,
+                       None if year_from is None else int(year_from),
+                       None if year_to is None else int(year_to),
+                       **params)
+
+
+def load_index(source=None):
+    """Load and index the cached Disbursements."""
+    from utils.prepared import prepare
+    from utils.query import QueryIndex
+    from utils.read_data import load_table
+
+    data = load_table('Disbursements', columns=COLUMNS, file_path=source)
+    return QueryIndex(prepare(data))
+
+
+def parse_args(argv=None):
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--source', action='append',
+                        help="database the cache was built from, repeated "
+                             "if it was built from several; by default the "
+                             "database in data/")
+    parser.add_argument('--host', default='127.0.0.1',
+                        help="address to listen on")
+    parser.add_argument('--port', type=int, default=8000,
+                        help="port to listen on")
+    parser.add_argument('--cache-size', type=int, default=1024,
+                        help="responses to cache")
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    index = load_index(args.source)
+
+    server = ThreadingHTTPServer((args.host, args.port), QueryHandler)
+    server.respond = responder(index, args.cache_size)
+
+    print('Serving {} rows of expenditure on http://{}:{}/'.format(
+        len(index), args.host, args.port))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""
+Columnar on-disk cache of the tables read from the database.
+
+Each table is stored in its own parquet file so that a single table, or a
+subset of its columns, can be loaded without touching the rest. A manifest
+records the content hash of the source database so that a stale cache is
+never read. It also records the size and modification time of the source,
+so that the source is only hashed again when those change.
+"""
+
+import hashlib
+import json
+import os
+import os.path as path
+
+import pandas as pd
+
+from utils.df_tools import concat_typed
+
+MANIFEST = 'manifest.json'
+
+
+def source_hash(file_path, block_size=1 << 20):
+    """Compute the sha256 content hash of the file at file_path.
+
+    If file_path is a directory (e.g. of CSV exports) the hash covers the
+    names and contents of every file in it. If it is a list of databases (or
+    directories) the hash covers each of them, in order.
+    """
+    sha = hashlib.sha256()
+
+    if isinstance(file_path, (list, tuple)):
+        for source in file_path:
+            sha.update(source_hash(source, block_size).encode())
+        return sha.hexdigest()
+
+    for file in __source_files(file_path):
+        sha.update(path.basename(file).encode())
+
+        # Read file in blocks so large databases are never held in memory
+        with open(file, 'rb') as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                sha.update(block)
+
+    return sha.hexdigest()
+
+
+def source_stat(file_path):
+    """List the name, size and modification time of each file of the source
+    at file_path (a database, a directory or a list of them, as for
+    source_hash())."""
+    if isinstance(file_path, (list, tuple)):
+        return [source_stat(source) for source in file_path]
+
+    stats = []
+    for file in __source_files(file_path):
+        stat = os.stat(file)
+        stats.append([path.basename(file), stat.st_size, stat.st_mtime_ns])
+
+    return stats
+
+
+def __source_files(file_path):
+    """The files making up the database (or directory) at file_path."""
+    if not path.isdir(file_path):
+        return [file_path]
+
+    file_paths = [path.join(file_path, file)
+                  for file in sorted(os.listdir(file_path))]
+    return [file for file in file_paths if path.isfile(file)]
+
+
+def read_manifest(cache_dir):
+    """Return the cache manifest, or None if the cache has not been written."""
+    manifest_path = path.join(cache_dir, MANIFEST)
+
+    if not path.isfile(manifest_path):
+        return None
+
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def write_manifest(cache_dir, manifest):
+    """Atomically replace the cache manifest."""
+    manifest_path = path.join(cache_dir, MANIFEST)
+    tmp_path = manifest_path + '.tmp'
+
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    os.replace(tmp_path, manifest_path)
+
+
+def write_table(cache_dir, table, df):
+    """Write df to cache_dir as table and return its manifest entry."""
+    file_name = '{}.parquet'.format(table)
+    tmp_path = path.join(cache_dir, file_name + '.tmp')
+
+    # Write to a temporary file first so readers never see half a table
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path.join(cache_dir, file_name))
+
+    return {'file': file_name,
+            'columns': list(df.columns),
+            'rows': len(df)}
+
+
+def write_cache(accdb, source_path, cache_dir, watermarks=None):
+    """Write each table in accdb to its own file in cache_dir.
+
+    watermarks optionally maps table names to the watermark recorded for
+    incremental ingest (see merge_rows).
+    """
+    # Create cache directory if it doesn't exist
+    if not path.exists(cache_dir):
+        os.makedirs(cache_dir)
+
+    if watermarks is None:
+        watermarks = {}
+
+    if isinstance(source_path, (list, tuple)):
+        source = [path.basename(file) for file in source_path]
+    else:
+        source = path.basename(source_path)
+
+    manifest = {'source': source,
+                'sha256': source_hash(source_path),
+                'stat': source_stat(source_path),
+                'tables': {}}
+
+    for table, df in accdb.items():
+        manifest['tables'][table] = write_table(cache_dir, table, df)
+        manifest['tables'][table]['watermark'] = watermarks.get(table)
+
+    # Manifest written last: it is what marks the cache as valid
+    write_manifest(cache_dir, manifest)
+
+    return manifest
+
+
+def watermark(df, key, changed=None):
+    """Return the highest key (and change marker) in df, or None.
+
+    None is returned if df has no key column, in which case the table can
+    only ever be ingested in full.
+    """
+    if key not in df.columns or df.empty:
+        return None
+
+    mark = {'key': df[key].max().item()}
+
+    if changed and changed in df.columns and df[changed].notna().any():
+        # Compared as times: text in different ISO 8601 forms (e.g. with a
+        # space or 'T') does not sort in time order as strings
+        latest = pd.to_datetime(df[changed], format='ISO8601').max()
+
+        # Timestamps are stored as ISO strings to keep the manifest JSON
+        mark['changed'] = pd.Timestamp(latest).isoformat()
+
+    return mark
+
+
+def merge_rows(cached, new_rows, key):
+    """Merge new or modified rows into a cached table, replacing on key."""
+    merged = concat_typed([cached, new_rows])
+
+    # A row that was modified appears twice: keep the freshly read version
+    merged = merged.drop_duplicates(subset=key, keep='last')
+
+    return merged.sort_values(key, ignore_index=True)
+
+
+def check_cache(cache_dir, source_path):
+    """Ensure the cache in cache_dir was built from source_path's contents."""
+    manifest = read_manifest(cache_dir)
+
+    assert manifest is not None, \
+        "No cache found in {}. Run accdb2pkl() first.".format(cache_dir)
+
+    # An unchanged size and modification time needs no rehashing
+    stat = source_stat(source_path)
+    if manifest.get('stat') == stat:
+        return manifest
+
+    assert manifest['sha256'] == source_hash(source_path), \
+        ("Cache in {} is stale: {} has changed since it was cached. "
+         "Run accdb2pkl() to rebuild it.".format(cache_dir, source_path))
+
+    # Same contents, e.g. a copy: skip the hash next time
+    manifest['stat'] = stat
+    write_manifest(cache_dir, manifest)
+
+    return manifest
+
+
+def read_cache(cache_dir, source_path, table, columns=None):
+    """Load table from the cache, optionally restricted to columns."""
+    return read_tables(cache_dir, source_path, [table], columns)[table]
+
+
+def read_tables(cache_dir, source_path, tables=None, columns=None):
+    """Load tables (by default all of them) from the cache as a dictionary."""
+    # Check the source once, however many tables are requested
+    manifest = check_cache(cache_dir, source_path)
+
+    if tables is None:
+        tables = list(manifest['tables'])
+
+    accdb = {}
+    for table in tables:
+        # Columns may be given per table or once for every table
+        table_columns = (columns.get(table) if isinstance(columns, dict)
+                         else columns)
+
+        accdb[table] = read_cache_unchecked(cache_dir, table, table_columns,
+                                            manifest)
+
+    return accdb
+
+
+def iter_cache(cache_dir, source_path, table, columns=None, rows=100000):
+    """Iterate over table from the cache in DataFrames of at most rows rows.
+
+    Only one partition of the table is held in memory at a time.
+    """
+    import pyarrow.parquet as pq
+
+    manifest = check_cache(cache_dir, source_path)
+
+    assert table in manifest['tables'], \
+        "Table '{}' not found in cache {}".format(table, cache_dir)
+
+    file_name = manifest['tables'][table]['file']
+    parquet = pq.ParquetFile(path.join(cache_dir, file_name))
+
+    return (batch.to_pandas()
+            for batch in parquet.iter_batches(batch_size=rows,
+                                              columns=columns))
+
+
+def read_cache_unchecked(cache_dir, table, columns=None, manifest=None):
+    """Load table from the cache without checking it against its source.
+
+    Only for use when the source is known to have changed, e.g. when new
+    rows are about to be merged into the cached table.
+    """
+    if manifest is None:
+        manifest = read_manifest(cache_dir)
+
+    assert manifest is not None and table in manifest['tables'], \
+        "Table '{}' not found in cache {}".format(table, cache_dir)
+
+    file_name = manifest['tables'][table]['file']
+
+    return pd.read_parquet(path.join(cache_dir, file_name), columns=columns)
@@ -0,0 +1,81 @@
+"""
+Expenditure summed once over parish, year and category, for reuse by every
+report which slices it.
+"""
+
+from utils.prepared import prepare
+
+
+class ExpenditureCube:
+    """Total expenditure of data keyed by (Parish_Name, Year, category).
+
+    Building the cube is a single pass over data; every entry of category,
+    and the total annual expenditure it is compared with, is then a slice
+    of the cube rather than another pass over the full table. data is a
+    DisbursementsFrame (or the Disbursements, which are prepared first) and
+    is neither copied nor modified.
+    """
+
+    def __init__(self, data, category):
+        self.category = category
+
+        data = prepare(data).data
+
+        # Keep rows without a category: they still count towards the total
+        keys = [data['Parish_Name'], data['Year'], data[category]]
+        cube = data['Total'].groupby(keys, observed=True, dropna=False).sum()
+
+        # Rows without a parish or date were never part of any report
+        parish = cube.index.get_level_values('Parish_Name')
+        year = cube.index.get_level_values('Year')
+        self.cube = cube[parish.notna() & year.notna()]
+
+        self.__totals = {}
+
+    def entry(self, entry, by_parish=True):
+        """Expenditure on entry, per parish and year or per year."""
+        if entry in self.cube.index.get_level_values(self.category):
+            entry_total = self.cube.xs(entry, level=self.category)
+        else:
+            entry_total = self.cube.iloc[:0].droplevel(self.category)
+
+        if not by_parish:
+            entry_total = entry_total.groupby(level='Year',
+                                              observed=True).sum()
+
+        return entry_total
+
+    def entries(self, entries=None, by_parish=True):
+        """Expenditure on each of entries (by default every entry), per column.
+
+        Entries without any expenditure are left out, as is expenditure
+        without a category, which only counts towards the totals. Where an
+        entry has no expenditure in a parish and year the value is missing.
+        """
+        category = self.cube.index.get_level_values(self.category)
+        keep = category.notna()
+
+        if entries is not None:
+            keep &= category.isin(entries)
+
+        cube = self.cube[keep]
+
+        # One column per entry, from a single pivot of the cube
+        wide = cube.unstack(self.category)
+
+        if entries is not None:
+            wide = wide[[entry for entry in entries if entry in wide.columns]]
+
+        if not by_parish:
+            wide = wide.groupby(level='Year', observed=True).sum(min_count=1)
+
+        return wide
+
+    def totals(self, by_parish=True):
+        """Total expenditure, per parish and year or per year."""
+        if by_parish not in self.__totals:
+            levels = ['Parish_Name', 'Year'] if by_parish else ['Year']
+            self.__totals[by_parish] = self.cube.groupby(level=levels,
+                                                       observed=True).sum()
+
+        return self.__totals[by_parish]
@@ -4,40 +4,74 @@ with the Disbursements dataset.
 """
 
 import pandas as pd
+from pandas.api.types import union_categoricals
+
+from utils.instrument import stage
+from utils.money import from_pds, to_pds
+
+# Columns holding an amount of money
+PDS = ['Pounds', 'Shillings', 'Pence']
 
 
 def make_year_col(data):
     """Create a 'Year' column from data's 'Date' column."""
-    data['Year'] = data['Date'].map(lambda x: x.year)
+    with stage('year'):
+        data['Year'] = data['Date'].dt.year
     return data
 
 
 def total_from_pds(data):
-    """Compute the total expenditure in pence."""
-    data['Total'] = (data.Pounds * 20 * 12
-                   + data.Shillings * 12
-                   + data.Pence)
+    """Compute the total expenditure as a single 'Total' column of dtype lsd."""
+    with stage('total'):
+        data['Total'] = from_pds(data.Pounds, data.Shillings, data.Pence)
     return data
 
 
 def tidy_pds(data):
     """Tidy up 'Pounds', 'Shillings' and 'Pence columns."""
-    # Make sure the columns are ints
+    # Carry pence into shillings and shillings into pounds
+    pds = to_pds(from_pds(data.Pounds, data.Shillings, data.Pence))
+
     if isinstance(data, pd.core.frame.DataFrame):
-        data = data.astype({'Pounds': int,
-                            'Shillings': int,
-                            'Pence': int})
+        pds.index = data.index
+        return data.assign(**pds)
 
-    # Convert pence to shillings
-    data.Shillings += data.Pence // 12
+    # A single amount, e.g. the result of data.sum()
+    data = data.copy()
+    data[PDS] = pds.iloc[0].values
+    return data
 
-    # Left over / uncoverted pence
-    data.Pence %= 12
 
-    # Convert shillings to pounds
-    data.Pounds += data.Shillings // 20
+def concat_typed(frames):
+    """Concatenate frames, keeping categorical columns categorical.
 
-    # Left over / unconverted shillings
-    data.Shillings %= 20
+    pd.concat falls back to object dtype when the frames' categories differ,
+    as they do for chunks read one after another, so categorical columns are
+    combined separately with the union of their categories. Categories are
+    sorted, as astype('category') sorts them, so that the result (and the
+    order of every groupby on it) does not depend on how the rows were split
+    into frames.
+    """
+    frames = [df for df in frames if len(df.columns)]
 
-    return data
+    if not frames:
+        return pd.DataFrame()
+
+    # Empty frames add no rows, and their categories may be of another dtype
+    # (e.g. object rather than str), which union_categoricals refuses
+    frames = [df for df in frames if len(df)] or frames[:1]
+
+    columns = frames[0].columns
+    categorical = [col for col in columns
+                   if isinstance(frames[0][col].dtype, pd.CategoricalDtype)
+                   and all(isinstance(df[col].dtype, pd.CategoricalDtype)
+                           for df in frames)]
+
+    data = pd.concat([df.drop(columns=categorical) for df in frames],
+                     ignore_index=True)
+
+    for col in categorical:
+        data[col] = union_categoricals([df[col] for df in frames],
+                                       sort_categories=True)
+
+    return data[columns]
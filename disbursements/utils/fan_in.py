@@ -0,0 +1,108 @@
+"""
+Read the tables of several databases at once and merge them into one.
+
+The archive may be split over many databases, e.g. one per deanery or batch
+of transcription. Each database is read by its own worker process (see
+read_sources), every row is tagged with the database it came from in a
+Source column, and the tables of every database are concatenated. Rows
+transcribed into more than one database are then dropped (see deduplicate),
+keeping the copy from the first database listed.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import os
+import os.path as path
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from utils import instrument
+from utils.df_tools import concat_typed
+from utils.instrument import stage
+from utils.readers import reader_for
+
+# Number of worker processes databases are read on. 1 reads them in turn.
+PROCESSES = int(os.environ.get('INGEST_PROCESSES', os.cpu_count() or 1))
+
+# Column naming the database each row was read from
+SOURCE = 'Source'
+
+
+def read_source(source, tables, **reader_kwargs):
+    """Read tables from source, each tagged with the name of source."""
+    name = path.basename(path.normpath(source))
+
+    with stage(name):
+        accdb = reader_for(source, **reader_kwargs).read_tables(tables)
+
+    for df in accdb.values():
+        df[SOURCE] = pd.Categorical.from_codes(np.zeros(len(df), dtype='int8'),
+                                               [name])
+
+    return accdb
+
+
+def read_sources(sources, tables, processes=None, **reader_kwargs):
+    """Read tables from every one of sources and concatenate them.
+
+    Sources are read on up to processes worker processes (by default
+    PROCESSES). Rows keep the order of sources, then of each database.
+    """
+    if processes is None:
+        processes = PROCESSES
+
+    processes = min(processes, len(sources))
+
+    if processes > 1:
+        # Workers trace memory allocations if this process does
+        with ProcessPoolExecutor(processes,
+                                 initializer=__init_worker,
+                                 initargs=(tracemalloc.is_tracing(),)) as pool:
+            futures = [pool.submit(__read_recorded, source, tables,
+                                   reader_kwargs)
+                       for source in sources]
+
+            read = []
+            for future in futures:
+                accdb, recorded = future.result()
+                read.append(accdb)
+                instrument.merge(recorded)
+    else:
+        read = [read_source(source, tables, **reader_kwargs)
+                for source in sources]
+
+    with stage('concat'):
+        return {table: concat_typed([accdb[table] for accdb in read])
+                for table in tables}
+
+
+def deduplicate(df, key='ID'):
+    """Drop rows of df which repeat a row of an earlier database.
+
+    Rows are compared on every column but the key and Source, as each
+    database numbers its rows independently.
+    """
+    columns = [col for col in df.columns if col not in (key, SOURCE)]
+
+    if not columns or df.empty:
+        return df
+
+    # The database each distinct row was first read from. Repeats within
+    # that database are kept: they may be genuine, e.g. identical payments
+    first = df.groupby(columns, observed=True, dropna=False,
+                       sort=False)[SOURCE].transform('first')
+    overlap = (df[SOURCE] != first).to_numpy()
+
+    return df[~overlap].reset_index(drop=True)
+
+
+def __read_recorded(source, tables, reader_kwargs):
+    """Read source in a worker process, returning the stages it recorded."""
+    return read_source(source, tables, **reader_kwargs), instrument.drain()
+
+
+def __init_worker(tracing):
+    """Record only the worker's own stages, tracing memory if the parent does."""
+    instrument.reset()
+    instrument.tracing(tracing)
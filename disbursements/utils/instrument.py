@@ -0,0 +1,239 @@
+"""
+Record the wall time, CPU time and memory used by each stage of a run.
+
+Wrap a stage in `with stage('name'):` (or decorate a function with
+@timed('name')) to record it. Stages nest, and are named by their path,
+e.g. 'standards/annual_total/groupby'. Every call of a stage is recorded;
+report() sums the calls of each stage and write_report() saves the summary
+as JSON or CSV.
+
+Recording costs little and is always on. Tracing memory allocations with
+tracemalloc slows a run down considerably, so is off unless enabled with
+RUN_TRACEMALLOC=1 (or tracing(True)). Set RUN_REPORT=<path> to write a
+report, and RUN_PROFILE=<path> to dump a cProfile of the run, when run_me.py
+finishes.
+"""
+
+import contextlib
+import cProfile
+import csv
+import functools
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows: peak RSS is not recorded
+    resource = None
+
+# Columns of a report, in order
+FIELDS = ['stage', 'calls', 'wall', 'cpu', 'rss_growth_mb',
+          'process_peak_rss_mb', 'traced_peak_mb']
+
+# Recorded calls of each stage, and the stages currently running
+__records = []
+__running = []
+
+
+def tracing(enable=None):
+    """Start (or stop) tracing memory allocations; return whether tracing."""
+    if enable is None:
+        enable = os.environ.get('RUN_TRACEMALLOC', '0') != '0'
+
+    if enable and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    elif not enable and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+    return tracemalloc.is_tracing()
+
+
+def max_rss():
+    """Peak resident set size of this process so far in bytes, if known."""
+    if resource is None:
+        return None
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Reported in bytes on macOS, kilobytes elsewhere
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Record the time and memory used by the code run in this context."""
+    path = '/'.join([frame['path'] for frame in __running[-1:]] + [name])
+    frame = {'path': path, 'traced_peak': 0}
+
+    # The process's peak RSS only ever grows, so the stage's share of it
+    # is how far the stage raised it
+    rss = max_rss()
+
+    traced = tracemalloc.is_tracing()
+    if traced:
+        # The peak so far belongs to the enclosing stage
+        current, peak = tracemalloc.get_traced_memory()
+        if __running:
+            __running[-1]['traced_peak'] = max(__running[-1]['traced_peak'],
+                                               peak)
+        tracemalloc.reset_peak()
+
+    __running.append(frame)
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    try:
+        yield
+    finally:
+        wall = time.perf_counter() - wall
+        cpu = time.process_time() - cpu
+        __running.pop()
+
+        peak_rss = max_rss()
+        record = {'stage': path, 'wall': wall, 'cpu': cpu,
+                  'rss_growth': None if rss is None else peak_rss - rss,
+                  'peak_rss': peak_rss, 'traced_peak': None}
+
+        if traced and tracemalloc.is_tracing():
+            # Peak of traced memory above that in use when the stage began
+            peak = max(frame['traced_peak'],
+                       tracemalloc.get_traced_memory()[1])
+            record['traced_peak'] = peak - current
+            if __running:
+                __running[-1]['traced_peak'] = max(
+                    __running[-1]['traced_peak'], peak)
+            tracemalloc.reset_peak()
+
+        __records.append(record)
+
+
+def timed(name=None):
+    """Decorate a function to record each call of it as a stage."""
+    def decorator(fn):
+        stage_name = name or fn.__name__.lstrip('_')
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(stage_name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def records():
+    """Return every call of a stage recorded so far."""
+    return list(__records)
+
+
+def drain():
+    """Return and forget the calls recorded so far, e.g. in a worker process."""
+    drained = list(__records)
+    del __records[:]
+    return drained
+
+
+def merge(recorded):
+    """Add calls recorded elsewhere, e.g. by a worker process.
+
+    The calls are recorded as part of the stage now running.
+    """
+    for record in recorded:
+        if __running:
+            record = dict(record,
+                          stage=__running[-1]['path'] + '/' + record['stage'])
+        __records.append(record)
+
+
+def reset():
+    """Forget every call recorded so far, and every stage running.
+
+    For a worker process, which starts with a copy of its parent's state.
+    """
+    del __records[:]
+    del __running[:]
+
+
+def report(recorded=None):
+    """Summarise the calls of each stage, in the order stages first ran.
+
+    rss_growth_mb is the most any call of the stage raised the peak resident
+    set size of the process it ran in; it is zero for a stage which stayed
+    within the memory of an earlier, heavier one. process_peak_rss_mb is
+    that process's peak RSS so far when the stage finished, which is shared
+    by every stage after the heaviest.
+    """
+    if recorded is None:
+        recorded = __records
+
+    summary = {}
+    for record in recorded:
+        row = summary.setdefault(record['stage'],
+                                 {'stage': record['stage'],
+                                  'calls': 0,
+                                  'wall': 0.,
+                                  'cpu': 0.,
+                                  'rss_growth_mb': None,
+                                  'process_peak_rss_mb': None,
+                                  'traced_peak_mb': None})
+        row['calls'] += 1
+        row['wall'] += record['wall']
+        row['cpu'] += record['cpu']
+        row['rss_growth_mb'] = __max_mb(row['rss_growth_mb'],
+                                        record['rss_growth'])
+        row['process_peak_rss_mb'] = __max_mb(row['process_peak_rss_mb'],
+                                              record['peak_rss'])
+        row['traced_peak_mb'] = __max_mb(row['traced_peak_mb'],
+                                         record['traced_peak'])
+
+    return list(summary.values())
+
+
+def __max_mb(mb, value):
+    """The larger of mb and value (in bytes) in megabytes, if either is known."""
+    if value is None:
+        return mb
+
+    value = value / 2 ** 20
+    return value if mb is None else max(mb, value)
+
+
+def write_report(file_path, meta=None):
+    """Write the report to file_path, as CSV if it ends .csv else as JSON."""
+    rows = report()
+
+    if file_path.endswith('.csv'):
+        with open(file_path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+    else:
+        with open(file_path, 'w') as f:
+            json.dump({'meta': meta or {}, 'stages': rows}, f, indent=2)
+
+    print('Run report written to {}'.format(file_path))
+
+
+@contextlib.contextmanager
+def profiled(file_path=None):
+    """Profile the code run in this context, dumping stats to file_path.
+
+    Nothing is profiled if file_path is None. Only this process is
+    profiled, not the processes plots are rendered on.
+    """
+    if not file_path:
+        yield
+        return
+
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        profile.dump_stats(file_path)
+        print('Profile written to {}'.format(file_path))
@@ -0,0 +1,367 @@
+"""
+A pandas extension dtype for sums of money in pounds, shillings and pence.
+
+Amounts are held as a single int64 array of pence (12 pence to the shilling
+and 20 shillings to the pound) so they can be summed, grouped and aggregated
+natively. They are only split into pounds, shillings and pence on output.
+"""
+
+import numpy as np
+import pandas as pd
+from pandas.api.extensions import (ExtensionArray,
+                                   ExtensionDtype,
+                                   register_extension_dtype,
+                                   take)
+from pandas.api.indexers import check_array_indexer
+
+PENCE_PER_SHILLING = 12
+PENCE_PER_POUND = 20 * PENCE_PER_SHILLING
+
+# Marks a missing amount in the array of pence
+_NA = np.iinfo(np.int64).min
+
+
+def format_lsd(pence):
+    """Format a whole number of pence as '£l s d'."""
+    sign = '-' if pence < 0 else ''
+    pounds, pence = divmod(abs(pence), PENCE_PER_POUND)
+    shillings, pence = divmod(pence, PENCE_PER_SHILLING)
+    return '{}£{} {}s {}d'.format(sign, pounds, shillings, pence)
+
+
+class Lsd(int):
+    """A single sum of money, stored as a whole number of pence."""
+
+    @property
+    def pounds(self):
+        return int(self) // PENCE_PER_POUND
+
+    @property
+    def shillings(self):
+        return int(self) % PENCE_PER_POUND // PENCE_PER_SHILLING
+
+    @property
+    def pence(self):
+        return int(self) % PENCE_PER_SHILLING
+
+    def __repr__(self):
+        return "Lsd('{}')".format(self)
+
+    def __str__(self):
+        return format_lsd(int(self))
+
+
+@register_extension_dtype
+class LsdDtype(ExtensionDtype):
+    """Extension dtype of LsdArray."""
+
+    name = 'lsd'
+    type = Lsd
+    na_value = pd.NA
+    _is_numeric = True
+
+    @classmethod
+    def construct_array_type(cls):
+        return LsdArray
+
+
+class LsdArray(ExtensionArray):
+    """Array of sums of money, backed by a single int64 array of pence."""
+
+    def __init__(self, pence, copy=False):
+        self._pence = np.array(pence, dtype=np.int64, copy=copy or None)
+
+    # --- Construction ---
+
+    @classmethod
+    def _from_sequence(cls, scalars, *, dtype=None, copy=False):
+        if isinstance(scalars, cls):
+            return scalars.copy() if copy else scalars
+
+        values = np.asarray(scalars)
+
+        # Whole numbers of pence need no conversion
+        if values.dtype.kind in 'iu':
+            return cls(values, copy=copy)
+
+        # Anything else may contain missing values
+        mask = pd.isna(values)
+        pence = np.full(len(values), _NA, dtype=np.int64)
+        pence[~mask] = values[~mask].astype(np.int64)
+        return cls(pence)
+
+    @classmethod
+    def _from_factorized(cls, values, original):
+        return cls(values)
+
+    @classmethod
+    def _concat_same_type(cls, to_concat):
+        return cls(np.concatenate([array._pence for array in to_concat]))
+
+    # --- Array interface ---
+
+    @property
+    def dtype(self):
+        return LsdDtype()
+
+    @property
+    def nbytes(self):
+        return self._pence.nbytes
+
+    @property
+    def pence(self):
+        """The amounts in pence, as float with NaN if any are missing."""
+        return np.asarray(self)
+
+    def __len__(self):
+        return len(self._pence)
+
+    def __getitem__(self, item):
+        if np.ndim(item) == 0 and not isinstance(item, slice):
+            value = self._pence[item]
+            return pd.NA if value == _NA else Lsd(value)
+
+        item = check_array_indexer(self, item)
+        return type(self)(self._pence[item])
+
+    def __setitem__(self, key, value):
+        key = check_array_indexer(self, key)
+
+        if pd.api.types.is_scalar(value):
+            value = _NA if pd.isna(value) else int(value)
+        else:
+            value = type(self)._from_sequence(value)._pence
+
+        self._pence[key] = value
+
+    def __array__(self, dtype=None, copy=None):
+        # Boxed as Lsd scalars, e.g. for display
+        if dtype is not None and np.dtype(dtype) == object:
+            return np.array(list(self), dtype=object)
+
+        mask = self.isna()
+
+        # Missing amounts can only be represented as NaN
+        if mask.any():
+            values = self._pence.astype(np.float64)
+            values[mask] = np.nan
+        else:
+            values = self._pence
+
+        return values if dtype is None else values.astype(dtype)
+
+    def isna(self):
+        return self._pence == _NA
+
+    def copy(self):
+        return type(self)(self._pence, copy=True)
+
+    def take(self, indices, allow_fill=False, fill_value=None):
+        if allow_fill and (fill_value is None or pd.isna(fill_value)):
+            fill_value = _NA
+        elif allow_fill:
+            fill_value = int(fill_value)
+
+        return type(self)(take(self._pence, indices,
+                               allow_fill=allow_fill,
+                               fill_value=fill_value))
+
+    def _values_for_factorize(self):
+        return self._pence, _NA
+
+    def _values_for_argsort(self):
+        return self._pence
+
+    def _formatter(self, boxed=False):
+        return str
+
+    # --- Reductions ---
+
+    def sum(self, skipna=True, min_count=0):
+        """Total of the amounts as a single Lsd."""
+        return self._reduce('sum', skipna=skipna, min_count=min_count)
+
+    def _reduce(self, name, *, skipna=True, keepdims=False, **kwargs):
+        mask = self.isna()
+        values = self._pence[~mask]
+
+        if mask.any() and not skipna:
+            result = pd.NA
+        elif name == 'sum':
+            if len(values) < kwargs.get('min_count', 0):
+                result = pd.NA
+            else:
+                result = Lsd(values.sum())
+        elif name in ('min', 'max'):
+            result = Lsd(getattr(values, name)()) if len(values) else pd.NA
+        elif name == 'mean':
+            # Mean amounts are not in general whole numbers of pence
+            return values.mean() if len(values) else np.nan
+        else:
+            raise TypeError("'{}' is not supported for dtype "
+                            "'{}'".format(name, self.dtype))
+
+        if keepdims:
+            return type(self)._from_sequence([result])
+
+        return result
+
+    def _groupby_op(self, *, how, has_dropped_na, min_count, ngroups, ids,
+                    **kwargs):
+        # Rows in a group, and with an amount, contribute to the result
+        valid = (ids >= 0) & ~self.isna()
+        ids = ids[valid]
+        values = self._pence[valid]
+        counts = np.bincount(ids, minlength=ngroups)
+
+        if how == 'sum':
+            result = np.zeros(ngroups, dtype=np.int64)
+            np.add.at(result, ids, values)
+            result[counts < min_count] = _NA
+        elif how in ('min', 'max'):
+            if how == 'min':
+                ufunc, initial = np.minimum, np.iinfo(np.int64).max
+            else:
+                ufunc, initial = np.maximum, np.iinfo(np.int64).min
+            result = np.full(ngroups, initial, dtype=np.int64)
+            ufunc.at(result, ids, values)
+            result[counts == 0] = _NA
+        elif how == 'mean':
+            sums = np.zeros(ngroups, dtype=np.float64)
+            np.add.at(sums, ids, values)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                return sums / counts
+        else:
+            raise TypeError("'{}' is not supported for dtype "
+                            "'{}'".format(how, self.dtype))
+
+        return type(self)(result)
+
+    # --- Arithmetic and comparisons ---
+
+    def _operand(self, other):
+        """Return other as an array of pence and its missing value mask."""
+        if isinstance(other, LsdArray):
+            return other._pence, other.isna()
+
+        if pd.api.types.is_scalar(other) and pd.isna(other):
+            return np.zeros(len(self), dtype=np.int64), True
+
+        return np.asarray(other, dtype=np.int64), False
+
+    def _arith(self, other, op):
+        if isinstance(other, (pd.Series, pd.Index, pd.DataFrame)):
+            return NotImplemented
+
+        values, mask = self._operand(other)
+        result = op(self._pence, values)
+        return type(self)(np.where(self.isna() | mask, _NA, result))
+
+    def _compare(self, other, op):
+        if isinstance(other, (pd.Series, pd.Index, pd.DataFrame)):
+            return NotImplemented
+
+        values, mask = self._operand(other)
+        return op(self._pence, values) & ~(self.isna() | mask)
+
+    def __add__(self, other):
+        return self._arith(other, np.add)
+
+    def __radd__(self, other):
+        return self._arith(other, np.add)
+
+    def __sub__(self, other):
+        return self._arith(other, np.subtract)
+
+    def __rsub__(self, other):
+        return self._arith(other, lambda x, y: y - x)
+
+    def __mul__(self, other):
+        return self._arith(other, np.multiply)
+
+    def __rmul__(self, other):
+        return self._arith(other, np.multiply)
+
+    def __neg__(self):
+        return type(self)(np.where(self.isna(), _NA, -self._pence))
+
+    def __truediv__(self, other):
+        """Ratio of amounts, as float (NaN where either is missing)."""
+        if isinstance(other, (pd.Series, pd.Index, pd.DataFrame)):
+            return NotImplemented
+
+        values, mask = self._operand(other)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            result = self._pence / values
+        result[self.isna() | mask] = np.nan
+        return result
+
+    def __eq__(self, other):
+        return self._compare(other, np.equal)
+
+    def __ne__(self, other):
+        return self._compare(other, np.not_equal)
+
+    def __lt__(self, other):
+        return self._compare(other, np.less)
+
+    def __le__(self, other):
+        return self._compare(other, np.less_equal)
+
+    def __gt__(self, other):
+        return self._compare(other, np.greater)
+
+    def __ge__(self, other):
+        return self._compare(other, np.greater_equal)
+
+
+def _whole_numbers(values):
+    """Return values as an int64 array, counting missing values as zero,
+    and a mask of which values were missing."""
+    values = pd.to_numeric(pd.Series(values if np.ndim(values) else [values]))
+
+    return values.fillna(0).to_numpy(dtype=np.int64), values.isna().to_numpy()
+
+
+def from_pds(pounds, shillings, pence):
+    """Combine pounds, shillings and pence into a single LsdArray.
+
+    An amount is missing if none of its pounds, shillings and pence were
+    recorded; otherwise a missing denomination is counted as zero (e.g. an
+    amount recorded only in shillings).
+    """
+    pounds, no_pounds = _whole_numbers(pounds)
+    shillings, no_shillings = _whole_numbers(shillings)
+    pence, no_pence = _whole_numbers(pence)
+
+    total = (pounds * PENCE_PER_POUND
+             + shillings * PENCE_PER_SHILLING
+             + pence)
+
+    return LsdArray(np.where(no_pounds & no_shillings & no_pence, _NA,
+                             total))
+
+
+def to_pds(values):
+    """Split amounts into 'Pounds', 'Shillings' and 'Pence' columns.
+
+    values may be a Series or array of dtype lsd (or of whole pence). If it
+    is a Series its index is kept.
+    """
+    index = values.index if isinstance(values, pd.Series) else None
+    values = LsdArray._from_sequence(pd.array(values))
+
+    pounds, pence = np.divmod(values._pence, PENCE_PER_POUND)
+    shillings, pence = np.divmod(pence, PENCE_PER_SHILLING)
+
+    pds = pd.DataFrame({'Pounds': pounds,
+                        'Shillings': shillings,
+                        'Pence': pence},
+                       index=index)
+
+    # Keep missing amounts missing
+    mask = values.isna()
+    if mask.any():
+        pds = pds.astype('Int64').mask(mask)
+
+    return pds
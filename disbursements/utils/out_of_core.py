@@ -0,0 +1,116 @@
+"""
+Summarise Disbursements too large to hold in memory, a partition at a time.
+
+Every report sums expenditure over some of parish, year and category, and
+sums can be taken in parts: summing each partition of the table by all of
+its keys at once, then summing those partial sums, gives the same totals as
+summing the whole table. PartitionedFrame does this while streaming the
+table (from the cache, see read_data.stream_table, or straight from a
+reader backend), so only one partition and the partial sums are ever in
+memory.
+
+The result stands in for a DisbursementsFrame: each of its rows is the
+total of a parish, year and combination of categories rather than a single
+payment, which every report sums over in the same way.
+"""
+
+import os
+
+import pandas as pd
+
+from utils.df_tools import PDS, concat_typed
+from utils.instrument import stage
+from utils.money import from_pds
+from utils.prepared import DisbursementsFrame
+
+# Rows of the table read at a time, and of partial sums held before merging
+PARTITION_ROWS = int(os.environ.get('PARTITION_ROWS', 1000000))
+
+
+def partial_sums(partition):
+    """Total expenditure of partition, keyed by parish, year and category.
+
+    Every text column of partition is a key, as is the year of each
+    payment; other columns (e.g. ID) are dropped. Rows missing a key are
+    kept, as they count towards the totals of the keys they do have.
+    """
+    year = partition['Date'].dt.year.rename('Year')
+    total = pd.Series(from_pds(partition.Pounds,
+                               partition.Shillings,
+                               partition.Pence),
+                      index=partition.index,
+                      name='Total')
+
+    keys = [__categorical(partition[col]) for col in partition.columns
+            if col not in PDS and col != 'Date'
+            and __is_text(partition[col])]
+
+    sums = total.groupby(keys + [year], observed=True, dropna=False).sum()
+    return sums.reset_index()
+
+
+def merge_sums(partials):
+    """Sum partial sums (see partial_sums) which share keys."""
+    sums = concat_typed(partials)
+    keys = [col for col in sums.columns if col != 'Total']
+
+    merged = sums.groupby(keys, observed=True, dropna=False,
+                          sort=False)['Total'].sum()
+    return merged.reset_index()
+
+
+class PartitionedFrame(DisbursementsFrame):
+    """The Disbursements summed a partition at a time.
+
+    partitions is an iterable of DataFrames of the Disbursements, e.g.
+    read_data.stream_table() or a reader's chunks(). Partial sums are merged
+    whenever they reach rows rows (by default PARTITION_ROWS), so memory is
+    bounded by the partition size and the number of distinct keys, not by
+    the size of the table.
+
+    .data has the layout of DisbursementsFrame.data, less the Date and any
+    other column which is not a key, and is read by the reports in the same
+    way.
+    """
+
+    def __init__(self, partitions, rows=None):
+        if rows is None:
+            rows = PARTITION_ROWS
+
+        partials = []
+        held = 0
+
+        with stage('partitioned'):
+            for partition in partitions:
+                with stage('partial'):
+                    partials.append(partial_sums(partition))
+                held += len(partials[-1])
+
+                # Keep the partial sums held in memory bounded
+                if held > rows and len(partials) > 1:
+                    with stage('merge'):
+                        partials = [merge_sums(partials)]
+                    held = len(partials[0])
+
+            with stage('merge'):
+                sums = merge_sums(partials)
+
+            # Sort by parish and year, as the prepared Disbursements are
+            with stage('sort'):
+                self.data = sums.sort_values(['Parish_Name', 'Year'],
+                                             kind='stable',
+                                             ignore_index=True)
+
+
+def __is_text(column):
+    """Whether column holds text (or categories) to group by."""
+    return (isinstance(column.dtype, pd.CategoricalDtype)
+            or pd.api.types.is_string_dtype(column.dtype))
+
+
+def __categorical(column):
+    """column as a category, so partitions' keys merge without rehashing."""
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return column
+
+    return column.astype('category')
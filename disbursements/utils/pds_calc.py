@@ -3,12 +3,30 @@
 """
 This script is intended to make it easier to sum up monies detailed in pounds,
 shillings and pence.
+
+Run without arguments to be prompted for the monies to sum. Alternatively
+name files (or - for stdin) to sum the monies they list, either row-wise or
+column-wise as for the prompts, for example:
+
+    ./pds_calc.py transcription.csv
+    ./pds_calc.py --key 0 --output subtotals.csv transcription.csv
+    ./pds_calc.py --layout col - < columns.txt
+
+Files are read and summed in fixed-size chunks, so may be of any length.
 """
 
+import argparse
+import numpy as np
 import pandas as pd
 import sys
 
-from df_tools import tidy_pds
+from money import Lsd, PENCE_PER_POUND, PENCE_PER_SHILLING, from_pds
+
+# Entries read and summed at a time in batch mode
+CHUNKSIZE = 100000
+
+# Largest pence (or shillings, or pounds) an int64 sum can reach
+INT64_MAX = np.iinfo(np.int64).max
 
 
 def get_inputs():
@@ -107,17 +125,249 @@ def get_col_inputs():
 
 def perform_sum(data):
     """Sum and tidy inputted data."""
-    summed = tidy_pds(data.sum())
+    summed = from_pds(data.Pounds, data.Shillings, data.Pence).sum()
 
     print('\nTotal is: {} pounds, {} shillings'
-          ' and {} pence.'.format(summed.Pounds,
-                                  summed.Shillings,
-                                  summed.Pence))
+          ' and {} pence.'.format(summed.pounds,
+                                  summed.shillings,
+                                  summed.pence))
+
+
+def read_rows(f, key=None, header=False, chunksize=CHUNKSIZE):
+    """Yield chunks of row-wise entries in f as (keys, pounds, shillings, pence).
+
+    Each line holds pounds, shillings and pence separated by commas. If key
+    is given, the field at that (0-based) position is instead a key to
+    subtotal by, e.g. a folio or parish, and keys is a Series of them.
+    """
+    fields = [field for field in range(4 if key is not None else 3)
+              if field != key]
+    dtype = {field: 'int64' for field in fields}
+    if key is not None:
+        dtype[key] = str
+
+    chunks = pd.read_csv(f,
+                         header=None,
+                         names=list(range(len(dtype))),
+                         index_col=False,
+                         skiprows=1 if header else 0,
+                         dtype=dtype,
+                         skipinitialspace=True,
+                         chunksize=chunksize)
+
+    for chunk in chunks:
+        # Entries without a key are subtotalled together
+        keys = chunk[key].fillna('') if key is not None else None
+        yield (keys,) + tuple(chunk[field].to_numpy() for field in fields)
+
+
+def read_cols(f, chunksize=CHUNKSIZE):
+    """Yield chunks of column-wise entries in f as (line, values).
+
+    All the pounds are on the first line, all the shillings on the second
+    and all the pence on the third, each separated by commas. Lines are read
+    a block at a time, so need not fit in memory.
+    """
+    line = 0
+    rest = ''
+
+    while True:
+        block = f.read(chunksize * 8)
+        text = rest + block
+        pieces = text.split('\n')
+
+        for i, piece in enumerate(pieces):
+            last = i == len(pieces) - 1
+
+            # Hold back the end of the block: it may be part of a value
+            rest = ''
+            if last and block:
+                cut = piece.rfind(',')
+                piece, rest = piece[:max(cut, 0)], piece[cut + 1:]
+
+            values = piece.replace(' ', '').strip()
+            if values:
+                yield line, np.array(values.split(','), dtype=np.int64)
+
+            if not last:
+                line += 1
+
+        if not block:
+            break
+
+
+def __exact_sum(values):
+    """Sum an int64 array exactly, in int64 unless that could overflow."""
+    if not len(values):
+        return 0
+
+    if np.abs(values).max() <= INT64_MAX // len(values):
+        return int(values.sum())
+
+    return sum(values.tolist())
+
+
+def __pence(pounds, shillings, pence):
+    """Combine int64 arrays into pence, or None if that could overflow."""
+    largest = max(np.abs(values).max() for values in (pounds, shillings, pence))
+
+    # Each entry is at most 253 times its largest denomination
+    if largest > INT64_MAX // (253 * len(pounds)):
+        return None
 
+    return pounds * PENCE_PER_POUND + shillings * PENCE_PER_SHILLING + pence
 
-def main():
-    df = get_inputs()
-    perform_sum(df)
+
+def sum_rows(chunks):
+    """Sum row-wise chunks, returning the total pence per key.
+
+    Without keys the total is keyed by None. Totals are Python ints, so
+    never overflow however many entries are summed.
+    """
+    totals = {}
+
+    for keys, pounds, shillings, pence in chunks:
+        if not len(pounds):
+            continue
+
+        combined = __pence(pounds, shillings, pence)
+
+        if combined is None:
+            # Too large to sum in int64: sum exactly entry by entry
+            combined = [l * PENCE_PER_POUND + s * PENCE_PER_SHILLING + d
+                        for l, s, d in zip(pounds.tolist(),
+                                           shillings.tolist(),
+                                           pence.tolist())]
+            combined = pd.Series(combined, dtype=object)
+        else:
+            combined = pd.Series(combined)
+
+        if keys is None:
+            subtotals = {None: combined.sum()}
+        else:
+            subtotals = combined.groupby(keys.to_numpy(), sort=False).sum()
+
+        for key, subtotal in subtotals.items():
+            totals[key] = totals.get(key, 0) + int(subtotal)
+
+    return totals
+
+
+def sum_cols(chunks):
+    """Sum column-wise chunks, returning the total pence."""
+    sums = [0, 0, 0]
+    counts = [0, 0, 0]
+
+    for line, values in chunks:
+        if line > 2:
+            print("\nExpected three lines, of pounds, shillings and pence. "
+                  "Found a line {}.".format(line + 1))
+            sys.exit(1)
+
+        sums[line] += __exact_sum(values)
+        counts[line] += len(values)
+
+    # Ensure there are an equal number of each entry
+    if not counts[1:] == counts[:-1]:
+        print("\nThere must be an equal number of pounds, pence and "
+              "shillings. There are {} pound entries, {} shilling entries "
+              "and {} pence entries.".format(*counts))
+        sys.exit(1)
+
+    return (sums[0] * PENCE_PER_POUND
+            + sums[1] * PENCE_PER_SHILLING
+            + sums[2])
+
+
+def tabulate_totals(totals):
+    """Tabulate total pence per key in pounds, shillings and pence."""
+    keys = sorted(totals)
+    monies = [Lsd(totals[key]) for key in keys]
+
+    return pd.DataFrame([(lsd.pounds, lsd.shillings, lsd.pence)
+                         for lsd in monies],
+                        columns=['Pounds', 'Shillings', 'Pence'],
+                        index=pd.Index(keys, name='Key'))
+
+
+def batch(args):
+    """Sum the monies listed in the files named in args."""
+    totals = {}
+
+    for file_path in args.files:
+        f = sys.stdin if file_path == '-' else open(file_path)
+
+        try:
+            if args.layout == 'row':
+                file_totals = sum_rows(read_rows(f,
+                                                 args.key,
+                                                 args.header,
+                                                 args.chunksize))
+            else:
+                file_totals = {None: sum_cols(read_cols(f, args.chunksize))}
+        except ValueError as error:
+            print("\nERROR: could not read {}: {}".format(file_path, error))
+            sys.exit(1)
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+        for key, total in file_totals.items():
+            totals[key] = totals.get(key, 0) + total
+
+    # Subtotals, if entries were keyed
+    if args.key is not None:
+        subtotals = tabulate_totals(totals)
+
+        if args.output:
+            subtotals.to_csv(args.output)
+        else:
+            print(subtotals.to_string())
+
+    summed = Lsd(sum(totals.values()))
+
+    print('\nTotal is: {} pounds, {} shillings'
+          ' and {} pence.'.format(summed.pounds,
+                                  summed.shillings,
+                                  summed.pence))
+
+
+def parse_args(argv=None):
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('files', nargs='*',
+                        help="files listing monies to sum, or - for stdin; "
+                             "if none are given you are prompted for them")
+    parser.add_argument('--layout', choices=['row', 'col'], default='row',
+                        help="row: a line of pounds,shillings,pence per "
+                             "entry; col: a line each of all the pounds, "
+                             "shillings and pence")
+    parser.add_argument('--key', type=int,
+                        help="(row layout) position of a field to subtotal "
+                             "by, e.g. 0 for key,pounds,shillings,pence")
+    parser.add_argument('--header', action='store_true',
+                        help="(row layout) skip the first line of each file")
+    parser.add_argument('--output',
+                        help="write subtotals to this CSV file")
+    parser.add_argument('--chunksize', type=int, default=CHUNKSIZE,
+                        help="entries to read and sum at a time")
+
+    args = parser.parse_args(argv)
+
+    if args.layout == 'col' and args.key is not None:
+        parser.error("--key applies only to the row layout")
+
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.files:
+        batch(args)
+    else:
+        df = get_inputs()
+        perform_sum(df)
 
 
 if __name__ == "__main__":
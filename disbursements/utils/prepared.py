@@ -0,0 +1,73 @@
+"""
+The Disbursements prepared once for every report which reads them.
+
+Reports sum expenditure by parish, year and category. Rather than each
+report deriving the year and the total from the raw table (and copying it to
+avoid modifying the caller's frame), the derived columns are computed once
+and every report reads the same prepared frame.
+"""
+
+import pandas as pd
+
+from utils.df_tools import PDS
+from utils.instrument import stage
+from utils.money import from_pds
+
+
+class DisbursementsFrame:
+    """Disbursements with the columns every report needs, derived once.
+
+    .data holds every column of the table, except pounds, shillings and
+    pence, plus:
+
+        Year   the year of each payment, vectorised from Date
+        Total  the payment as a single lsd column of pence
+
+    Text columns are categorical, and rows are sorted by parish and year.
+    Reports read .data but never modify or copy it.
+    """
+
+    def __init__(self, data):
+        with stage('prepare'):
+            with stage('year'):
+                year = data['Date'].dt.year.rename('Year')
+
+            with stage('total'):
+                total = pd.Series(from_pds(data.Pounds,
+                                           data.Shillings,
+                                           data.Pence),
+                                  index=data.index,
+                                  name='Total')
+
+            # Group keys as categories, so grouping never hashes strings
+            with stage('keys'):
+                columns = {col: self.__categorical(data[col])
+                           for col in data.columns if col not in PDS}
+
+            # Sort by parish and year: groups become contiguous
+            with stage('sort'):
+                prepared = pd.DataFrame(dict(columns, Year=year, Total=total),
+                                        index=data.index)
+                self.data = prepared.sort_values(['Parish_Name', 'Year'],
+                                                 kind='stable',
+                                                 ignore_index=True)
+
+    def __len__(self):
+        return len(self.data)
+
+    @staticmethod
+    def __categorical(column):
+        """column as a category if it holds text, else unchanged."""
+        if pd.api.types.is_string_dtype(column.dtype) \
+                and not isinstance(column.dtype, pd.CategoricalDtype):
+            return column.astype('category')
+
+        return column
+
+
+def prepare(data):
+    """Return data as a DisbursementsFrame, preparing it if not already."""
+    if isinstance(data, DisbursementsFrame):
+        return data
+
+    return DisbursementsFrame(data)
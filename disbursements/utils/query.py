@@ -0,0 +1,160 @@
+"""
+Answer ad-hoc questions about expenditure from indexes over the Disbursements.
+
+"How much did parish P spend on X between years A and B, and what share of
+its total expenditure was that?" is answered by summing a few rows of a
+cube of expenditure keyed by parish, year and category, located through
+indexes rather than by scanning the full table:
+
+    Parish_Name  the cube is sorted by parish, so each parish is a
+                 contiguous range of rows
+    Year         within a parish rows are sorted by year, so a range of
+                 years is found by binary search
+    categories   each value of Primary_category and Standardized_Category
+                 maps to the sorted positions of its rows
+"""
+
+import numpy as np
+import pandas as pd
+
+from utils.instrument import stage
+from utils.money import Lsd
+from utils.prepared import prepare
+
+# Columns which may be filtered on by value
+CATEGORIES = ['Primary_category', 'Standardized_Category']
+
+
+class QueryIndex:
+    """Indexes over the expenditure of data, for answering queries.
+
+    data is a DisbursementsFrame, or the Disbursements to prepare. Only the
+    summed cube and its indexes are kept, not data itself.
+    """
+
+    def __init__(self, data):
+        data = prepare(data).data
+        categories = [col for col in CATEGORIES if col in data.columns]
+
+        with stage('index'):
+            # Expenditure summed over every combination of keys
+            cube = data.groupby(['Parish_Name', 'Year'] + categories,
+                                observed=True,
+                                dropna=False)['Total'].sum()
+
+            parish = pd.Categorical(cube.index.get_level_values('Parish_Name'))
+            year = cube.index.get_level_values('Year').to_numpy(dtype=float)
+
+            # Sort by parish, then year: parishes are ranges of rows
+            order = np.lexsort((year, parish.codes))
+            self.__pence = cube.array.pence[order]
+            self.__parish_codes = parish.codes[order]
+            self.__year = year[order]
+            self.__parishes = {name: code
+                               for code, name in enumerate(parish.categories)}
+
+            # Inverted index: value -> sorted positions of its rows
+            self.__values = {}
+            for col in categories:
+                values = pd.Categorical(cube.index.get_level_values(col))
+                self.__values[col] = self.__positions(values.codes[order],
+                                                      values.categories)
+
+    def __len__(self):
+        return len(self.__pence)
+
+    def values(self, column):
+        """The values which may be queried in column."""
+        if column == 'Parish_Name':
+            return sorted(self.__parishes)
+        if column == 'Year':
+            years = self.__year[~np.isnan(self.__year)]
+            return sorted(int(year) for year in np.unique(years))
+
+        assert column in self.__values, \
+            "Cannot query on '{}'".format(column)
+
+        return sorted(self.__values[column])
+
+    def query(self, parish=None, year_from=None, year_to=None, **filters):
+        """Expenditure matching filters, absolute and as % of the total.
+
+        The total is all expenditure of parish (or every parish) between
+        year_from and year_to inclusive (by default every year). filters map
+        columns in CATEGORIES to the value to sum expenditure on, e.g.
+        Standardized_Category='Funeral'.
+        """
+        rows = self.__select(parish, year_from, year_to)
+        total = int(self.__pence[rows].sum())
+
+        matching = rows
+        for column, value in filters.items():
+            assert column in self.__values, \
+                "Cannot filter on '{}'".format(column)
+
+            positions = self.__values[column].get(value, np.empty(0, int))
+            matching = self.__restrict(positions, matching)
+
+        spend = int(self.__pence[matching].sum())
+
+        return {'parish': parish,
+                'year_from': year_from,
+                'year_to': year_to,
+                'filters': filters,
+                'spend': self.__money(spend),
+                'total': self.__money(total),
+                'percent': 100 * spend / total if total else None}
+
+    def __select(self, parish, year_from, year_to):
+        """Rows of parish between the years: a slice, or an array of rows."""
+        lo, hi = 0, len(self.__pence)
+
+        if parish is not None:
+            assert parish in self.__parishes, \
+                "No expenditure found for parish '{}'".format(parish)
+
+            code = self.__parishes[parish]
+            lo = np.searchsorted(self.__parish_codes, code, 'left')
+            hi = np.searchsorted(self.__parish_codes, code, 'right')
+
+        if year_from is None and year_to is None:
+            return slice(lo, hi)
+
+        year_from = -np.inf if year_from is None else year_from
+        year_to = np.inf if year_to is None else year_to
+
+        if parish is not None:
+            # Years are sorted within the parish
+            years = self.__year[lo:hi]
+            return slice(lo + np.searchsorted(years, year_from, 'left'),
+                         lo + np.searchsorted(years, year_to, 'right'))
+
+        year = self.__year
+        return np.flatnonzero((year >= year_from) & (year <= year_to))
+
+    def __restrict(self, positions, rows):
+        """Those of the sorted positions which are among rows."""
+        if isinstance(rows, slice):
+            return positions[np.searchsorted(positions, rows.start):
+                             np.searchsorted(positions, rows.stop)]
+
+        return np.intersect1d(positions, rows, assume_unique=True)
+
+    @staticmethod
+    def __positions(codes, categories):
+        """Map each of categories to the sorted positions of its codes."""
+        order = np.argsort(codes, kind='stable')
+        bounds = np.searchsorted(codes[order], np.arange(len(categories) + 1))
+
+        return {value: order[bounds[code]:bounds[code + 1]]
+                for code, value in enumerate(categories)}
+
+    @staticmethod
+    def __money(pence):
+        """pence as JSON serialisable pounds, shillings and pence."""
+        lsd = Lsd(pence)
+        return {'total_pence': pence,
+                'pounds': lsd.pounds,
+                'shillings': lsd.shillings,
+                'pence': lsd.pence,
+                'text': str(lsd)}
@@ -1,83 +1,219 @@
-"""Read data from .accdb file, store as a dict object and pickle."""
+"""Read data from the parish accounts database and store it in a columnar cache."""
 
-import os
 import os.path as path
-import pandas as pd
-import pickle
-import pyodbc
 
+from utils.cache import (iter_cache, merge_rows, read_cache,
+                         read_cache_unchecked, read_manifest, read_tables,
+                         watermark, write_cache)
+from utils.fan_in import deduplicate, read_sources
+from utils.instrument import stage
+from utils.readers import find_databases, reader_for
 
-def __read_accdb(file_path):
-    """Read accdb file from file_path and store as a dictionary."""
-    # Establish a connection to desired file
-    conn = pyodbc.connect(r'Driver={Microsoft Access Driver (*.mdb, *.accdb)};' +
-                          r'Dbq={}'.format(file_path))
 
-    # List of table in file
-    tables = ['Disbursements',
-              'Disbursement_Totals',
-              'Receipts',
-              'Receipts_Totals',
-              'Remains']
+# List of tables in file
+TABLES = ['Disbursements',
+          'Disbursement_Totals',
+          'Receipts',
+          'Receipts_Totals',
+          'Remains']
 
-    # Read tables in
-    accdb = {table: pd.read_sql('select * from {}'.format(table), conn)
-             for table in tables}
 
-    return accdb
+def __data_dir():
+    """Return the path to the data/ directory."""
+    return path.join(
+               path.dirname(
+                   path.dirname(
+                       path.realpath(__file__))),
+               'data')
 
 
-def accdb2pkl(file_path=None):
-    """Load accdb file and save as a pickled dictionary."""
-    # Construct the path to the data/ directory
-    data_dir_path = path.join(
-                        path.dirname(
-                            path.dirname(
-                                path.realpath(__file__))),
-                        'data')
+def __find_database(data_dir_path):
+    """Return the path to the database file in data_dir_path.
 
-    # If database not specified explicitly
-    if not file_path:
-        # List files with accdb extension in data/ directory
-        databases = [file for file in os.listdir(data_dir_path)
-                     if file.endswith('.accdb')]
-
-        # Prompt user to ensure data is located where it should be
-        assert len(databases) == 1, \
-            ("{} databases found in {}. "
-             "Ensure directory contains 1 database.".format(len(databases),
+    Several databases are only read as one when listed explicitly (see
+    accdb2pkl), so that a stray copy in data/ is never merged in.
+    """
+    # List files with a supported database extension in data/ directory
+    databases = find_databases(data_dir_path)
+
+    # Prompt user to ensure data is located where it should be
+    assert len(databases) == 1, \
+        ("{} databases found in {}. Ensure directory contains 1 database, "
+         "or pass each database to read explicitly.".format(len(databases),
                                                             data_dir_path))
 
-        # Construct path to database
-        file_path = path.join(data_dir_path, databases[0])
+    # Construct path to database
+    return path.join(data_dir_path, databases[0])
 
-    # Read accdb file in and store as a dictionary
-    accdb = __read_accdb(file_path)
 
-    # Output name
-    pkl_path = path.join(data_dir_path, 'accdb.pkl')
+def __source(file_path, data_dir_path):
+    """Return the database(s) to read: file_path, else those in data/."""
+    if not file_path:
+        return __find_database(data_dir_path)
 
-    # Pickle accdb and save in the output directory
-    with open(pkl_path, 'wb') as f:
-        pickle.dump(accdb, f, protocol=-1)
+    # A list of one database is that database
+    if isinstance(file_path, (list, tuple)) and len(file_path) == 1:
+        return file_path[0]
+
+    return file_path
 
-    return accdb
 
+def accdb2pkl(file_path=None, incremental=False, key='ID', changed=None,
+              cache_dir=None, processes=None, **reader_kwargs):
+    """Load database and save each table to the columnar cache.
 
-def load_pkl_accdb(pkl_path=None):
-    """Load and return the pickled accdb dictionary."""
-    if not pkl_path:
-        # Construct path to data directory
-        data_dir_path = path.join(
-                            path.dirname(
-                                path.dirname(
-                                    path.realpath(__file__))),
-                            'data')
-        # Get path to file
-        pkl_path = path.join(data_dir_path, 'accdb.pkl')
+    file_path may be an Access (.accdb/.mdb) or SQLite database, or a
+    directory of per-table CSV exports; by default the database in data/ is
+    used. reader_kwargs (e.g. chunksize, schema) are passed to the reader
+    backend (see utils.readers).
 
-    # Load file pkl_path
-    with open(pkl_path, 'rb') as f:
-        accdb = pickle.load(f)
+    file_path may also be a list of databases (e.g. --source given more
+    than once); several databases in data/ are never merged unless listed
+    like this. They are read on up to processes worker processes and
+    merged into one cache: every row is tagged with the database it came
+    from in a Source column, and rows repeating those of an earlier
+    database are dropped (see utils.fan_in).
+
+    With incremental=True only rows whose key column is larger than the
+    largest cached key, or whose changed column (e.g. a last-modified
+    timestamp) is later than the last one cached, are read from the
+    database and merged into the existing cache. Rows deleted from the
+    database are not removed by an incremental ingest; run a full ingest
+    to pick up deletions. Tables without the key column are always read in
+    full.
+
+    The cache is written to cache_dir, by default data/cache/.
+    """
+    # Construct the path to the data/ directory
+    data_dir_path = __data_dir()
+
+    if not cache_dir:
+        cache_dir = path.join(data_dir_path, 'cache')
+
+    # If database not specified explicitly
+    file_path = __source(file_path, data_dir_path)
+
+    fan_in = isinstance(file_path, (list, tuple))
+
+    # Keys are only unique within each database
+    assert not (incremental and fan_in), \
+        "Several databases can only be ingested in full, not incrementally."
+
+    manifest = read_manifest(cache_dir) if incremental else None
+
+    # Watermarks of previously cached tables
+    watermarks = {}
+    if manifest:
+        watermarks = {table: __usable_watermark(entry, changed)
+                      for table, entry in manifest['tables'].items()}
+
+    # Read database in (or only its new rows) and store as a dictionary
+    with stage('read'):
+        if fan_in:
+            accdb = read_sources(file_path, TABLES, processes,
+                                 **reader_kwargs)
+        else:
+            reader = reader_for(file_path, **reader_kwargs)
+            accdb = reader.read_tables(TABLES, watermarks, key, changed)
+
+    # Drop rows read from more than one database
+    if fan_in:
+        with stage('dedupe'):
+            accdb = {table: deduplicate(df, key)
+                     for table, df in accdb.items()}
+
+    # Merge new rows into the previously cached tables
+    with stage('merge'):
+        for table, new_rows in accdb.items():
+            if watermarks.get(table):
+                cached = read_cache_unchecked(cache_dir, table)
+                accdb[table] = merge_rows(cached, new_rows, key)
+
+    watermarks = {table: watermark(df, key, changed)
+                  for table, df in accdb.items()}
+
+    # Write one file per table, stamped with the database's content hash
+    with stage('cache.write'):
+        write_cache(accdb, file_path, cache_dir, watermarks)
 
     return accdb
+
+
+def __usable_watermark(entry, changed):
+    """The watermark of a cached table (see its manifest entry), if rows
+    beyond it are all that need reading.
+
+    A table cached with a changed column but no change marker (e.g. by an
+    ingest run without one) has none: its modified rows could only be found
+    by a full read.
+    """
+    mark = entry.get('watermark')
+
+    if mark and changed and changed in entry.get('columns', []) \
+            and not mark.get('changed'):
+        return None
+
+    return mark
+
+
+def load_table(table, columns=None, file_path=None, cache_dir=None):
+    """Load a single cached table, optionally restricted to columns.
+
+    The cache (by default data/cache/) is checked against the contents of
+    the database at file_path (by default the database in data/) and is
+    refused if it is stale.
+    """
+    data_dir_path = __data_dir()
+
+    file_path = __source(file_path, data_dir_path)
+
+    if not cache_dir:
+        cache_dir = path.join(data_dir_path, 'cache')
+
+    with stage('cache.read'):
+        return read_cache(cache_dir,
+                          file_path,
+                          table,
+                          columns=columns)
+
+
+def stream_table(table, columns=None, file_path=None, cache_dir=None,
+                 rows=100000):
+    """Iterate over a cached table in partitions of at most rows rows.
+
+    As load_table(), but the table is never held in memory as a whole.
+    """
+    data_dir_path = __data_dir()
+
+    file_path = __source(file_path, data_dir_path)
+
+    if not cache_dir:
+        cache_dir = path.join(data_dir_path, 'cache')
+
+    return iter_cache(cache_dir, file_path, table, columns=columns, rows=rows)
+
+
+def load_pkl_accdb(*, tables=None, columns=None, file_path=None,
+                   cache_dir=None):
+    """Load and return the cached tables as a dictionary.
+
+    By default every cached table is loaded. columns, if given, restricts
+    the columns loaded: either a list applied to every table or a dictionary
+    mapping table names to lists of columns.
+
+    Every argument is keyword-only: the first positional argument used to
+    be the path of the pickle, which the cache replaces (use file_path and
+    cache_dir).
+    """
+    data_dir_path = __data_dir()
+
+    file_path = __source(file_path, data_dir_path)
+
+    if not cache_dir:
+        cache_dir = path.join(data_dir_path, 'cache')
+
+    with stage('cache.read'):
+        return read_tables(cache_dir,
+                           file_path,
+                           tables=tables,
+                           columns=columns)
@@ -0,0 +1,220 @@
+"""
+Reader backends which load tables from the parish accounts database.
+
+Each backend streams a table in chunks and applies SCHEMA to every chunk as
+it is read, so a table is never held in memory with its default (object and
+float64) dtypes. Backends:
+
+    AccessReader    Microsoft Access database (.accdb/.mdb) read over ODBC.
+                    Requires pyodbc and the Microsoft Access driver.
+    SQLiteReader    SQLite database (.sqlite/.sqlite3/.db) holding the same
+                    tables.
+    CSVReader       Directory holding one <table>.csv export per table.
+"""
+
+import os
+import os.path as path
+import sqlite3
+
+import pandas as pd
+
+from utils.df_tools import concat_typed
+
+# Number of rows read at a time
+CHUNKSIZE = 100000
+
+# dtypes applied to columns while reading
+# Amounts are nullable, so an amount not recorded stays missing
+SCHEMA = {'Pounds': 'Int32',
+          'Shillings': 'Int16',
+          'Pence': 'Int16',
+          'Parish_Name': 'category',
+          'Primary_category': 'category',
+          'Standardized_Category': 'category',
+          # Second resolution, as accounts predate 1677 (the earliest
+          # date representable in nanoseconds)
+          'Date': 'datetime64[s]'}
+
+
+def apply_schema(chunk, schema=None):
+    """Cast the columns of chunk listed in schema to their declared dtype."""
+    if schema is None:
+        schema = SCHEMA
+
+    for col, dtype in schema.items():
+        if col not in chunk.columns:
+            continue
+
+        if dtype.lower().startswith('int'):
+            # Missing amounts are kept missing, not counted as zero
+            chunk[col] = pd.to_numeric(chunk[col]).astype(dtype)
+        elif dtype.startswith('datetime'):
+            chunk[col] = pd.to_datetime(chunk[col]).astype(dtype)
+        else:
+            chunk[col] = chunk[col].astype(dtype)
+
+    return chunk
+
+
+class Reader:
+    """Base class of the reader backends.
+
+    Subclasses implement _chunks(), which yields the raw chunks of a table,
+    restricted to rows beyond a watermark if one is given.
+    """
+
+    def __init__(self, source, chunksize=CHUNKSIZE, schema=None):
+        self.source = source
+        self.chunksize = chunksize
+        self.schema = SCHEMA if schema is None else schema
+
+    def chunks(self, table, mark=None, key='ID', changed=None):
+        """Yield table in typed chunks.
+
+        If mark is a watermark (see utils.cache.watermark) only rows whose
+        key column is larger than mark['key'], or whose changed column is
+        later than mark['changed'], are yielded.
+        """
+        for chunk in self._chunks(table, mark, key, changed):
+            yield apply_schema(chunk, self.schema)
+
+    def read_table(self, table, mark=None, key='ID', changed=None):
+        """Read table (or its rows beyond mark) into a single DataFrame."""
+        return concat_typed(self.chunks(table, mark, key, changed))
+
+    def read_tables(self, tables, watermarks=None, key='ID', changed=None):
+        """Read each of tables and return them as a dictionary."""
+        if watermarks is None:
+            watermarks = {}
+
+        return {table: self.read_table(table, watermarks.get(table),
+                                       key, changed)
+                for table in tables}
+
+    def _chunks(self, table, mark, key, changed):
+        raise NotImplementedError
+
+
+class _SQLReader(Reader):
+    """Backend reading tables with SQL queries over a DB-API connection."""
+
+    # Characters used to quote identifiers
+    quote = '""'
+
+    def _connect(self):
+        raise NotImplementedError
+
+    def _changed_param(self, value):
+        """Convert a stored change marker to a query parameter."""
+        return pd.Timestamp(value).to_pydatetime()
+
+    def _changed_clause(self, column):
+        """Condition that column is later than the change marker parameter."""
+        return '{} > ?'.format(column)
+
+    def _query(self, table, mark, key, changed):
+        """Construct the query (and its parameters) to read table."""
+        open_quote, close_quote = self.quote
+        query = 'select * from {}{}{}'.format(open_quote, table, close_quote)
+        params = []
+
+        if mark:
+            # New rows have a larger key than any row cached so far
+            clauses = ['{}{}{} > ?'.format(open_quote, key, close_quote)]
+            params.append(mark['key'])
+
+            # Modified rows carry a later change marker
+            if changed and mark.get('changed'):
+                clauses.append(self._changed_clause(
+                    '{}{}{}'.format(open_quote, changed, close_quote)))
+                params.append(self._changed_param(mark['changed']))
+
+            query += ' where ' + ' or '.join(clauses)
+
+        return query, params
+
+    def _chunks(self, table, mark, key, changed):
+        query, params = self._query(table, mark, key, changed)
+
+        conn = self._connect()
+        try:
+            yield from pd.read_sql(query, conn, params=params,
+                                   chunksize=self.chunksize)
+        finally:
+            conn.close()
+
+
+class AccessReader(_SQLReader):
+    """Read tables from a Microsoft Access database over ODBC."""
+
+    quote = '[]'
+
+    def _connect(self):
+        # Imported here so the other backends work without pyodbc installed
+        import pyodbc
+
+        return pyodbc.connect(r'Driver={Microsoft Access Driver (*.mdb, *.accdb)};' +
+                              r'Dbq={}'.format(self.source))
+
+
+class SQLiteReader(_SQLReader):
+    """Read tables from a SQLite database."""
+
+    def _connect(self):
+        return sqlite3.connect(self.source)
+
+    def _changed_param(self, value):
+        return pd.Timestamp(value).isoformat()
+
+    def _changed_clause(self, column):
+        # SQLite stores timestamps as ISO 8601 text, with a space or 'T'
+        # and with or without fractional seconds, which do not compare
+        # correctly as strings; compare them as (fractional) Julian days
+        return 'julianday({}) > julianday(?)'.format(column)
+
+
+class CSVReader(Reader):
+    """Read tables from a directory of per-table CSV exports."""
+
+    def _chunks(self, table, mark, key, changed):
+        file_path = path.join(self.source, '{}.csv'.format(table))
+
+        for chunk in pd.read_csv(file_path, chunksize=self.chunksize):
+            if mark:
+                # Keep only rows beyond the watermark
+                keep = chunk[key] > mark['key']
+                if changed and mark.get('changed'):
+                    modified = pd.to_datetime(chunk[changed],
+                                              format='ISO8601')
+                    keep |= modified > pd.Timestamp(mark['changed'])
+                chunk = chunk[keep]
+
+            yield chunk
+
+
+# Reader backend used for each database file extension
+BACKENDS = {'.accdb': AccessReader,
+            '.mdb': AccessReader,
+            '.sqlite': SQLiteReader,
+            '.sqlite3': SQLiteReader,
+            '.db': SQLiteReader}
+
+
+def reader_for(source, **kwargs):
+    """Return the reader backend for source: a database file or CSV directory."""
+    if path.isdir(source):
+        return CSVReader(source, **kwargs)
+
+    extension = path.splitext(source)[1].lower()
+
+    assert extension in BACKENDS, \
+        ("No reader backend for '{}'. Supported extensions are {}, or a "
+         "directory of CSV exports.".format(source, ', '.join(BACKENDS)))
+
+    return BACKENDS[extension](source, **kwargs)
+
+
+def find_databases(directory):
+    """List the database files in directory that have a reader backend."""
+    return sorted(file for file in os.listdir(directory)
+                  if path.splitext(file)[1].lower() in BACKENDS)
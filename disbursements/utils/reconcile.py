@@ -0,0 +1,142 @@
+"""
+Reconcile the accounts of each parish and year against the recorded totals.
+
+For every parish and year the itemised Receipts and Disbursements are summed
+and compared with the totals recorded for them (Receipts_Totals and
+Disbursement_Totals), and receipts less disbursements is compared with the
+recorded Remains. Every comparison is made for all parishes and years at
+once, on columns of pence.
+
+The layout of the tables other than Disbursements is assumed to follow
+that of Disbursements: a Parish_Name column, a Year column (or a Date column
+to take the year from) and the amount in Pounds, Shillings and Pence
+columns. Reconciling a table laid out otherwise fails, naming the columns
+it lacks.
+"""
+
+import numpy as np
+import pandas as pd
+
+from utils.money import from_pds
+
+# Itemised tables, and the tables of totals recorded for them
+ITEMISED = {'receipts': 'Receipts',
+            'disbursements': 'Disbursements'}
+RECORDED = {'receipts': 'Receipts_Totals',
+            'disbursements': 'Disbursement_Totals',
+            'remains': 'Remains'}
+
+# Comparisons made, as (name, computed column, recorded column)
+CHECKS = [('receipts', 'receipts', 'receipts_recorded'),
+          ('disbursements', 'disbursements', 'disbursements_recorded'),
+          ('remains', 'remains', 'remains_recorded')]
+
+
+def annual_sums(df, table='table'):
+    """Sum the amounts in df per parish and year, as nullable pence."""
+    missing = [col for col in ['Parish_Name', 'Pounds', 'Shillings', 'Pence']
+               if col not in df.columns]
+    if 'Year' not in df.columns and 'Date' not in df.columns:
+        missing.append('Year or Date')
+
+    assert not missing, \
+        "{} has no {} column to reconcile by".format(table, ', '.join(missing))
+
+    if 'Year' in df.columns:
+        year = pd.to_numeric(df['Year'])
+    else:
+        year = df['Date'].dt.year
+
+    pence = pd.Series(from_pds(df.Pounds, df.Shillings, df.Pence),
+                      index=df.index).array.pence
+
+    # Group on plain values: each table has its own parish categories
+    keys = [df['Parish_Name'].astype(object).rename('Parish_Name'),
+            year.rename('Year')]
+    # A year with no amount recorded stays missing, rather than summing to 0
+    sums = pd.Series(pence, index=df.index).groupby(keys).sum(min_count=1)
+
+    sums.index = sums.index.set_levels(sums.index.levels[1].astype(int),
+                                       level='Year')
+    return sums.astype('Int64')
+
+
+def reconcile(tables, tolerance=0, carry_forward=False):
+    """Reconcile every parish and year found in tables.
+
+    tables maps table names (as in read_data.TABLES) to DataFrames. Returns
+    a DataFrame indexed by parish and year of the computed and recorded
+    receipts, disbursements and remains, the difference between each pair
+    (in pence) and an 'issues' column naming each check which failed.
+
+    A check fails if the difference exceeds tolerance pence, or if there is
+    no recorded total to check against. With carry_forward, the remains
+    recorded for a parish's previous year are added to its receipts, for
+    accounts which do not list them as a receipt. Nothing is carried over a
+    gap: if the previous year has no recorded remains, but the parish has
+    accounts for an earlier year, a 'carry_forward' issue is noted instead.
+    """
+    columns = {}
+    for name, table in ITEMISED.items():
+        columns[name] = annual_sums(tables[table], table)
+    for name, table in RECORDED.items():
+        columns[name + '_recorded'] = annual_sums(tables[table], table)
+
+    # One row per parish and year found in any table
+    accounts = pd.concat(columns, axis=1).sort_index()
+
+    # Nothing itemised sums to nothing; a missing record stays missing
+    for name in ITEMISED:
+        accounts[name] = accounts[name].fillna(0)
+
+    issues = np.full(len(accounts), '', dtype=object)
+
+    receipts = accounts['receipts']
+    if carry_forward:
+        carried = __previous_year(accounts['remains_recorded'])
+        receipts = receipts + carried.fillna(0)
+
+        # A parish's first year has nothing to carry forward
+        later = accounts.groupby(level='Parish_Name').cumcount() > 0
+        gap = (carried.isna() & later).to_numpy()
+        issues = np.where(gap, 'carry_forward', issues)
+
+    accounts['remains'] = receipts - accounts['disbursements']
+
+    for name, computed, recorded in CHECKS:
+        difference = accounts[computed] - accounts[recorded]
+        accounts[name + '_difference'] = difference
+
+        failed = (difference.abs() > tolerance).fillna(True).to_numpy()
+        issues = np.where(failed, issues + ' ' + name, issues)
+
+    accounts['issues'] = pd.Series(issues, index=accounts.index).str.strip()
+
+    # Each computed amount beside its record and their difference
+    order = [col for name, computed, recorded in CHECKS
+             for col in (computed, recorded, name + '_difference')]
+    return accounts[order + ['issues']]
+
+
+def __previous_year(values):
+    """values (indexed by parish and year) of each parish's previous year.
+
+    Missing where the previous year has no value, rather than taking that of
+    an earlier year.
+    """
+    previous = values.copy()
+    years = previous.index.levels[1]
+    previous.index = previous.index.set_levels(years + 1, level='Year')
+
+    return previous.reindex(values.index)
+
+
+def discrepancies(accounts):
+    """The parishes and years of accounts which failed a check."""
+    return accounts[accounts['issues'] != '']
+
+
+def as_lsd(accounts):
+    """accounts with its amounts of pence as pounds, shillings and pence."""
+    return accounts.astype({col: 'lsd' for col in accounts.columns
+                            if col != 'issues'})
@@ -0,0 +1,143 @@
+"""
+Generate synthetic Disbursements data, e.g. for benchmarking.
+
+The data is deterministic: the same arguments always produce the same rows,
+however many rows are generated at a time. Rows are generated in blocks so
+that tens of millions of them can be written to disk without all being held
+in memory.
+"""
+
+import os
+import os.path as path
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from utils.df_tools import concat_typed
+from utils.read_data import TABLES
+
+# Rows generated at a time, each block from its own random stream
+BLOCK = 1000000
+
+# Primary categories, as plotted by plot.standards
+PRIMARY_CATEGORIES = ['Bells',
+                      'Charity',
+                      'Churchyard',
+                      'Church Interior',
+                      'Church Structure',
+                      'Communion Bread and Wine',
+                      'Miscellaneous',
+                      'Parish Administration']
+
+# Standardized categories which always exist, as reported on by run_me.py
+STANDARDIZED_CATEGORIES = ['Funeral',
+                           'Perambulation',
+                           'Book of Common Prayer',
+                           'Sermons']
+
+# Sizes of dataset: (parishes, years, standardized categories, rows)
+SCALES = {'small': (20, 50, 20, 5000),
+          'medium': (100, 150, 100, 300000),
+          'large': (300, 250, 300, 3000000),
+          'huge': (600, 300, 500, 20000000)}
+
+
+def __names(prefix, n, first=()):
+    """n names: those in first, then prefix numbered."""
+    names = list(first[:n])
+    names += ['{} {:04d}'.format(prefix, i) for i in range(n - len(names))]
+    return names
+
+
+def blocks(rows, parishes=100, years=150, categories=100, seed=0,
+           first_year=1600):
+    """Yield synthetic Disbursements, BLOCK rows at a time.
+
+    Rows are spread uniformly over parishes parishes, years years from
+    first_year and categories standardized categories.
+    """
+    parish_names = pd.CategoricalDtype(__names('Parish', parishes))
+    primary = pd.CategoricalDtype(PRIMARY_CATEGORIES)
+    standardized = pd.CategoricalDtype(
+        __names('Category', categories, STANDARDIZED_CATEGORIES))
+
+    for start in range(0, rows, BLOCK):
+        n = min(BLOCK, rows - start)
+        rng = np.random.default_rng([seed, start // BLOCK])
+
+        # Dates spread uniformly over each year
+        year = rng.integers(first_year, first_year + years, n)
+        day = rng.integers(0, 365, n)
+        date = (pd.to_datetime(year.astype(str), format='%Y')
+                + pd.to_timedelta(day, unit='D'))
+
+        yield pd.DataFrame({
+            'ID': np.arange(start + 1, start + n + 1),
+            'Parish_Name': pd.Categorical.from_codes(
+                rng.integers(0, parishes, n), dtype=parish_names),
+            'Primary_category': pd.Categorical.from_codes(
+                rng.integers(0, len(PRIMARY_CATEGORIES), n), dtype=primary),
+            'Standardized_Category': pd.Categorical.from_codes(
+                rng.integers(0, categories, n), dtype=standardized),
+            'Date': date.astype('datetime64[s]'),
+            # Most payments are of a few shillings and pence
+            'Pounds': rng.geometric(0.6, n).astype('int32') - 1,
+            'Shillings': rng.integers(0, 20, n).astype('int16'),
+            'Pence': rng.integers(0, 12, n).astype('int16')})
+
+
+def disbursements(rows, **kwargs):
+    """Return synthetic Disbursements as a single DataFrame (see blocks)."""
+    return concat_typed(blocks(rows, **kwargs))
+
+
+def scale(name, **kwargs):
+    """Return the synthetic Disbursements of the named size in SCALES."""
+    parishes, years, categories, rows = SCALES[name]
+    return disbursements(rows, parishes=parishes, years=years,
+                         categories=categories, **kwargs)
+
+
+def write_sqlite(file_path, rows, **kwargs):
+    """Write synthetic Disbursements to a SQLite database at file_path.
+
+    The other tables read by accdb2pkl are created empty.
+    """
+    if path.exists(file_path):
+        os.remove(file_path)
+
+    conn = sqlite3.connect(file_path)
+    try:
+        for i, block in enumerate(blocks(rows, **kwargs)):
+            block['Date'] = block['Date'].dt.strftime('%Y-%m-%d')
+            block.to_sql('Disbursements', conn, index=False,
+                         if_exists='replace' if i == 0 else 'append')
+
+        for table in TABLES:
+            if table == 'Disbursements':
+                continue
+            conn.execute('create table {} (ID integer)'.format(table))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def write_csv(directory, rows, **kwargs):
+    """Write synthetic Disbursements as a directory of per-table CSV exports.
+
+    The other tables read by accdb2pkl are written empty.
+    """
+    if not path.exists(directory):
+        os.makedirs(directory)
+
+    table_path = path.join(directory, 'Disbursements.csv')
+    for i, block in enumerate(blocks(rows, **kwargs)):
+        block.to_csv(table_path, index=False, mode='w' if i == 0 else 'a',
+                     header=i == 0, date_format='%Y-%m-%d')
+
+    for table in TABLES:
+        if table == 'Disbursements':
+            continue
+        with open(path.join(directory, '{}.csv'.format(table)), 'w') as f:
+            f.write('ID\n')
@@ -1,61 +1,151 @@
 #! /usr/bin/env python3
 
-"""Draft."""
+"""Plot the network of marriages between parishes."""
 
-import matplotlib.pyplot as plt
-
-from utils.read_data import read
-
-pairs, counts, locations = read()
-
-
-# PLOT ALL #
-fig, ax = plt.subplots(1, 1)
-
-# Scatter towns
-ax.scatter(locations['Longitude'],
-           locations['Latitude'])
-
-# Annotate townships
-for i, row in locations.iterrows():
-    ax.annotate(row['Title'], row[['Longitude', 'Latitude']])
-
-# Draw edges between marriages
-for pair in pairs:
-    pair_locs = locations[locations['Title'].isin(pair)]
-    ax.plot(pair_locs.Longitude.values,
-            pair_locs.Latitude.values,
-            color='k',
-            alpha=0.65)
-
-ax.set_xticks([])
-ax.set_yticks([])
-
-fig.tight_layout(pad=0)
+import os.path as path
 
-fig.savefig('test_all.png')
-
-
-# ZOOM PLOT # 
-fig, ax = plt.subplots(1, 1)
-
-# Scatter towns
-ax.scatter(locations['Longitude'],
-           locations['Latitude'])
-
-mean = locations[['Longitude', 'Latitude']].mean()
-var = locations[['Longitude', 'Latitude']].var()
-
-ax.set_xlim((mean.Longitude - var.Longitude,
-             mean.Longitude + var.Longitude))
-ax.set_ylim((mean.Latitude - var.Latitude,
-             mean.Latitude + var.Latitude))
-
-# Annotate townships
-for i, row in locations.iterrows():
-    ax.annotate(row['Title'], row[['Longitude', 'Latitude']])
-
-ax.set_xticks([])
-ax.set_yticks([])
-
-fig.tight_layout(pad=0)
+from matplotlib.collections import LineCollection
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+from migration.utils.graph import MarriageGraph
+from migration.utils.locations import normalise
+from migration.utils.read_data import load_marriages
+
+# Number of parishes labelled, those with the most marriages between them
+LABELS = 30
+
+
+def network_edges(pairs, counts, locations):
+    """Join each pair of parishes to the coordinates of both ends.
+
+    pairs and counts are as returned by load_marriages(). Marriages between
+    the same two parishes are combined whichever way round they are, and
+    pairs with an end which could not be located, or which join a parish to
+    itself, are dropped. Returns a DataFrame of the coordinates of each end
+    and the number of marriages between them.
+    """
+    # Coordinates of each parish, by lookup key
+    name = 'Parish' if 'Parish' in locations.columns else 'Title'
+    coords = pd.DataFrame({'key': normalise(locations[name]).to_numpy(),
+                           'x': locations['Longitude'].to_numpy(dtype=float),
+                           'y': locations['Latitude'].to_numpy(dtype=float)})
+    coords = coords.drop_duplicates('key').set_index('key')
+
+    # Order the ends of each pair, so a-b and b-a are the same edge
+    pairs = np.asarray(pairs, dtype=object)
+    ends = np.sort(np.column_stack([normalise(pairs[:, 0]),
+                                    normalise(pairs[:, 1])]), axis=1)
+    edges = pd.DataFrame({'a': ends[:, 0], 'b': ends[:, 1],
+                          'count': np.asarray(counts)})
+    edges = edges[edges['a'] != edges['b']]
+    edges = edges.groupby(['a', 'b'], as_index=False,
+                          sort=False)['count'].sum()
+
+    # Join both ends to their coordinates at once
+    edges = edges.join(coords, on='a').join(coords, on='b', lsuffix='_a',
+                                            rsuffix='_b')
+
+    return edges.dropna(subset=['x_a', 'y_a', 'x_b', 'y_b'],
+                        ignore_index=True)
+
+
+def draw_network(ax, edges, locations, weight='width', max_width=4,
+                 labels=LABELS):
+    """Draw edges (see network_edges) and locations on ax.
+
+    Every edge is drawn in a single LineCollection, weighted by its number
+    of marriages: by line width up to max_width, or by alpha if weight is
+    'alpha'. Towns are drawn in a single scatter. matplotlib has no
+    collection of text, so each label is an artist of its own, and only
+    the number of parishes given by labels are labelled: those with the
+    most marriages with other parishes. labels=True labels every parish,
+    and a false value none.
+    """
+    ends = edges[['x_a', 'y_a', 'x_b', 'y_b']].to_numpy()
+    segments = ends.reshape(-1, 2, 2)
+
+    # Weight of each edge, from 0 to 1
+    counts = edges['count'].to_numpy()
+    scale = counts / counts.max() if len(counts) else counts
+
+    if weight == 'alpha':
+        colors = np.zeros((len(edges), 4))
+        colors[:, 3] = 0.1 + 0.9 * scale
+        lines = LineCollection(segments, colors=colors, linewidths=1)
+    else:
+        lines = LineCollection(segments, colors='k', alpha=0.65,
+                               linewidths=0.5 + (max_width - 0.5) * scale)
+
+    ax.add_collection(lines)
+
+    # Scatter towns
+    x = locations['Longitude'].to_numpy(dtype=float)
+    y = locations['Latitude'].to_numpy(dtype=float)
+    ax.scatter(x, y, zorder=2)
+
+    # Annotate the busiest townships
+    if labels:
+        shown = __busiest(edges, locations, None if labels is True
+                          else labels)
+        for title, xy in zip(locations['Title'].to_numpy()[shown],
+                             zip(x[shown], y[shown])):
+            ax.annotate(title, xy)
+
+    ax.set_xticks([])
+    ax.set_yticks([])
+
+
+def __busiest(edges, locations, n=None):
+    """Positions in locations of the n parishes with the most marriages
+    along edges (every parish if n is None), busiest first."""
+    name = 'Parish' if 'Parish' in locations.columns else 'Title'
+    keys = normalise(locations[name]).to_numpy()
+
+    # Marriages of each parish, at either end of an edge
+    ends = pd.concat([edges[['a', 'count']].set_axis(['key', 'count'],
+                                                     axis=1),
+                      edges[['b', 'count']].set_axis(['key', 'count'],
+                                                     axis=1)])
+    marriages = ends.groupby('key')['count'].sum()
+    marriages = marriages.reindex(keys, fill_value=0).to_numpy()
+
+    order = np.argsort(-marriages, kind='stable')
+    return order if n is None else order[:n]
+
+
+def main():
+    pairs, counts, locations = load_marriages()
+    edges = network_edges(pairs, counts, locations)
+
+    out_dir = path.join(
+                  path.dirname(
+                      path.dirname(
+                          path.realpath(__file__))),
+                  'output')
+
+    # PLOT ALL #
+    fig, ax = plt.subplots(1, 1)
+    draw_network(ax, edges, locations)
+    fig.tight_layout(pad=0)
+    fig.savefig(path.join(out_dir, 'marriage_network.png'))
+
+    # ZOOM PLOT #
+    mean = locations[['Longitude', 'Latitude']].mean()
+    var = locations[['Longitude', 'Latitude']].var()
+
+    ax.set_xlim((mean.Longitude - var.Longitude,
+                 mean.Longitude + var.Longitude))
+    ax.set_ylim((mean.Latitude - var.Latitude,
+                 mean.Latitude + var.Latitude))
+
+    fig.savefig(path.join(out_dir, 'marriage_network_zoom.png'))
+    plt.close(fig)
+
+    # Tabulate the measures of each parish, and each pair's marriages
+    MarriageGraph(pairs, counts).to_csv(out_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+#! /usr/bin/env python3
+
+"""
+Distances between the parishes of the groom and bride of each marriage.
+
+pair_distances() joins both parishes of every pair to their coordinates and
+computes every great circle (haversine) distance in one NumPy pass. The
+summaries below weight each pair by its number of marriages, and group by
+parish (of the groom, the bride or either) and/or by period:
+
+    distance_summary    marriages, mean and median distance and the share
+                        of marriages within each of a set of radii
+    distance_histogram  marriages in each band of distance
+"""
+
+import numpy as np
+import pandas as pd
+
+from migration.utils.locations import normalise
+
+# Mean radius of the Earth
+EARTH_RADIUS_KM = 6371.0088
+
+# Radii reported by distance_summary, in km
+RADII = [1, 5, 10, 20, 50]
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Great circle distance in km between points given in degrees."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(x, dtype=float))
+                              for x in (lat1, lon1, lat2, lon2))
+
+    a = (np.sin((lat2 - lat1) / 2) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def pair_distances(pairs, counts, locations, periods=None):
+    """Distance between the groom's and bride's parish of each pair.
+
+    pairs and counts are as returned by load_marriages() and locations by
+    lookup_locs(). periods optionally gives the period (e.g. year or
+    decade) of each pair. The distance is missing where either parish could
+    not be located.
+    """
+    pairs = np.asarray(pairs, dtype=object)
+
+    # Coordinates of each parish, by lookup key
+    name = 'Parish' if 'Parish' in locations.columns else 'Title'
+    keys = pd.Index(normalise(locations[name]))
+    first = ~keys.duplicated()
+    keys = keys[first]
+    lat = np.append(locations['Latitude'].to_numpy(dtype=float)[first],
+                    np.nan)
+    lon = np.append(locations['Longitude'].to_numpy(dtype=float)[first],
+                    np.nan)
+
+    # Position of each end's coordinates, or the trailing NaN if unknown
+    groom = keys.get_indexer(normalise(pairs[:, 0]))
+    bride = keys.get_indexer(normalise(pairs[:, 1]))
+
+    distances = pd.DataFrame({'Groom_Parish': pairs[:, 0],
+                              'Bride_Parish': pairs[:, 1],
+                              'Marriages': np.asarray(counts),
+                              'Distance_km': haversine(lat[groom], lon[groom],
+                                                       lat[bride],
+                                                       lon[bride])})
+    if periods is not None:
+        distances['Period'] = np.asarray(periods)
+
+    return distances
+
+
+def distance_summary(distances, by='Parish', radii=None):
+    """Distribution of distance married over, per group.
+
+    by names the column(s) to group on: 'Groom_Parish', 'Bride_Parish',
+    'Period', or 'Parish', under which every marriage counts towards both
+    of its parishes (once if they are the same). None summarises every
+    marriage at once. Pairs which could not be located count towards
+    Marriages but not the distances.
+    """
+    if radii is None:
+        radii = RADII
+
+    distances, by = __grouped(distances, by)
+    located = distances[distances['Distance_km'].notna()]
+
+    weight = located['Marriages'].to_numpy(dtype=float)
+    distance = located['Distance_km'].to_numpy()
+    codes, index = __group_codes(located, by)
+
+    if by:
+        marriages = distances.groupby(by, sort=True,
+                                      dropna=False)['Marriages'].sum()
+    else:
+        marriages = pd.Series([distances['Marriages'].sum()])
+    summary = marriages.to_frame('Marriages')
+
+    # Weighted sums over every group at once
+    def total(values):
+        return np.bincount(codes, values, minlength=len(index))
+
+    located_total = total(weight)
+    columns = {'Located': located_total,
+               'Mean_km': total(weight * distance) / located_total,
+               'Median_km': __weighted_median(codes, distance, weight,
+                                              located_total)}
+    for radius in radii:
+        columns['Within_{}km'.format(radius)] = \
+            total(weight * (distance <= radius)) / located_total
+
+    for col, values in columns.items():
+        summary[col] = pd.Series(values, index=index).reindex(summary.index)
+
+    # Groups with no located marriages
+    summary['Located'] = summary['Located'].fillna(0)
+
+    return summary
+
+
+def distance_histogram(distances, bins=None, by=None):
+    """Marriages in each band of distance (in km), per group.
+
+    bins are the edges of the bands (by default 0, 1, 2, 5, 10, 20, 50,
+    100 km and beyond). by is as for distance_summary(). Returns a table of
+    one column per band, one row per group.
+    """
+    if bins is None:
+        bins = [0, 1, 2, 5, 10, 20, 50, 100, np.inf]
+
+    distances, by = __grouped(distances, by)
+    located = distances[distances['Distance_km'].notna()]
+
+    band = pd.cut(located['Distance_km'], bins, right=False)
+    keys = [located[col] for col in by] + [band]
+
+    histogram = located['Marriages'].groupby(keys, observed=False).sum()
+
+    if not by:
+        return histogram.to_frame().T.reset_index(drop=True)
+
+    return histogram.unstack(fill_value=0)
+
+
+def __grouped(distances, by):
+    """distances ready to group on by, and by as a list of columns."""
+    if by is None:
+        return distances, []
+
+    by = [by] if isinstance(by, str) else list(by)
+
+    if 'Parish' not in by:
+        return distances, by
+
+    # Every marriage counts towards both its parishes, once if the same
+    groom = distances.rename(columns={'Groom_Parish': 'Parish'})
+    bride = distances.rename(columns={'Bride_Parish': 'Parish'})
+    bride = bride[(distances['Groom_Parish']
+                   != distances['Bride_Parish']).to_numpy()]
+
+    both = pd.concat([groom.drop(columns='Bride_Parish'),
+                      bride.drop(columns='Groom_Parish')],
+                     ignore_index=True)
+    return both, by
+
+
+def __group_codes(df, by):
+    """Code of each row's group (in sorted order), and the groups' index."""
+    if not by:
+        return np.zeros(len(df), dtype=np.intp), pd.RangeIndex(1)
+
+    grouper = df.groupby(by, sort=True, dropna=False)
+    return grouper.ngroup().to_numpy(), grouper.size().index
+
+
+def __weighted_median(codes, values, weights, totals):
+    """Weighted median of values within each group, without a Python loop."""
+    # Sort by group, then by value
+    order = np.lexsort((values, codes))
+    codes, values, weights = codes[order], values[order], weights[order]
+
+    # Cumulative weight within each group
+    cumulative = np.cumsum(weights)
+    starts = np.searchsorted(codes, np.arange(len(totals)))
+    before = np.append(0, cumulative)[starts]
+    within = cumulative - before[codes]
+
+    # First value of each group reaching half its weight
+    reached = within >= totals[codes] / 2
+    first = np.full(len(totals), np.nan)
+    positions = np.flatnonzero(reached)
+    groups, index = np.unique(codes[positions], return_index=True)
+    first[groups] = values[positions[index]]
+
+    return first
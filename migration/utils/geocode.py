@@ -0,0 +1,390 @@
+#! /usr/bin/env python3
+
+"""
+Geocoders which find the locations of parishes, and a runner to drive them.
+
+Every geocoder takes a batch of parish names and returns a DataFrame with
+the columns of the location store (see locations.COLUMNS) and a Parish
+column of the name asked for: one row per parish, with missing coordinates
+where it could not be found. Geocoders:
+
+    GazetteerGeocoder  resolves names against a local gazetteer file, such
+                       as an OS Open Names CSV, offline
+    SeleniumGeocoder   types names into gridreferencefinder.com in Chrome.
+                       Requires selenium and chromedriver.
+
+GeocodeRunner looks up only the parishes not already in the location store,
+in batches spread over worker threads, with rate limiting and retries, and
+stores each batch as soon as it is found.
+"""
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from migration.utils.locations import (COLUMNS, match_titles, normalise,
+                                       place_name)
+
+# Letters of the 500km and 100km squares of the British National Grid
+GRID_LETTERS = 'ABCDEFGHJKLMNOPQRSTUVWXYZ'
+
+# Airy 1830 ellipsoid and National Grid projection
+AIRY_A, AIRY_B = 6377563.396, 6356256.909
+F0 = 0.9996012717
+LAT0, LON0 = np.radians(49), np.radians(-2)
+N0, E0 = -100000, 400000
+
+# Helmert transform from OSGB36 to WGS84
+HELMERT_T = np.array([446.448, -125.157, 542.060])
+HELMERT_S = -20.4894e-6
+HELMERT_R = np.radians(np.array([0.1502, 0.2470, 0.8421]) / 3600)
+WGS84_A, WGS84_B = 6378137.000, 6356752.3142
+
+
+class Geocoder:
+    """Base class of the geocoders.
+
+    Subclasses implement _geocode(), which locates a batch of parishes,
+    returning the places found in the order the parishes were asked for,
+    or with a Parish column naming the parish each was found for.
+    batch_size (None for a single batch) and rate (batches per second, None
+    for no limit) suit the backend, and are used by GeocodeRunner.
+    """
+
+    batch_size = None
+    rate = None
+
+    def geocode(self, parishes):
+        """Locate parishes, returning a row (found or not) for each."""
+        parishes = np.asarray(parishes, dtype=object)
+        df = self._geocode(parishes)
+
+        if 'Parish' not in df.columns:
+            df = match_titles(parishes, df)
+
+        # Parishes the backend did not return are recorded as not found
+        found = np.isin(parishes, df['Parish'].to_numpy())
+        lost = pd.DataFrame({'Parish': parishes[~found],
+                             'Title': parishes[~found]},
+                            columns=['Parish'] + COLUMNS)
+
+        return pd.concat([df[['Parish'] + COLUMNS], lost],
+                         ignore_index=True)
+
+    def _geocode(self, parishes):
+        raise NotImplementedError
+
+
+class GazetteerGeocoder(Geocoder):
+    """Resolve parishes against a local gazetteer file, offline.
+
+    The gazetteer is a CSV with a column of place names and either British
+    National Grid coordinates (as in OS Open Names) or latitude and
+    longitude. Names are matched on their place name, without qualifiers
+    (see locations.place_name), with a single join. A parish with a
+    qualifier (e.g. 'Newton, Durham') only matches places whose counties
+    columns (those of them in the file) contain it. If types (e.g. ['City',
+    'Town', 'Village']) are given for a type column, only places of the
+    earliest type matching are considered. A parish matching more than one
+    place is left unresolved rather than taking any one of them.
+
+    read_kwargs are passed to pd.read_csv(), e.g. names for an OS Open
+    Names file, which has no header row.
+    """
+
+    def __init__(self, file_path, name='NAME1', easting='GEOMETRY_X',
+                 northing='GEOMETRY_Y', latitude=None, longitude=None,
+                 type_col=None, types=None,
+                 counties=('COUNTY_UNITARY', 'DISTRICT_BOROUGH'),
+                 **read_kwargs):
+        columns = [name] + ([latitude, longitude] if latitude
+                            else [easting, northing])
+        if type_col:
+            columns.append(type_col)
+        columns += list(counties or [])
+
+        # Counties columns are optional
+        places = pd.read_csv(file_path, usecols=lambda col: col in columns,
+                             **read_kwargs)
+        counties = [col for col in counties or [] if col in places.columns]
+
+        if types is not None:
+            # Rank places by type, keeping only the types listed
+            rank = pd.Categorical(places[type_col], categories=types,
+                                  ordered=True)
+            places = places[rank.notna()]
+            rank = rank.codes[rank.notna()]
+        else:
+            rank = np.zeros(len(places), dtype=int)
+
+        if latitude:
+            lat = pd.to_numeric(places[latitude]).to_numpy()
+            lon = pd.to_numeric(places[longitude]).to_numpy()
+            grid_ref = np.full(len(places), None, dtype=object)
+        else:
+            e = pd.to_numeric(places[easting]).to_numpy()
+            n = pd.to_numeric(places[northing]).to_numpy()
+            lat, lon = grid_to_latlon(e, n)
+            grid_ref = grid_reference(e, n)
+
+        # The counties of each place, as one normalised string
+        county = np.full(len(places), '', dtype=object)
+        for col in counties:
+            county = county + '|' + normalise(places[col].fillna('')).to_numpy()
+        key = place_name(places[name]).to_numpy()
+
+        self.gazetteer = pd.DataFrame({'key': key,
+                                       'rank': rank,
+                                       'county': county,
+                                       'Title': places[name].to_numpy(),
+                                       'Grid Reference': grid_ref,
+                                       'Latitude': lat,
+                                       'Longitude': lon})
+
+    def _geocode(self, parishes):
+        keys = normalise(parishes)
+        wanted = pd.DataFrame({'Parish': parishes,
+                               'key': keys.str.split(', ').str[0],
+                               'qualifier': keys.str.split(', ').str[1:]})
+
+        # Every place each parish could be
+        found = wanted.merge(self.gazetteer, on='key')
+
+        # A qualifier must appear among the place's counties
+        in_county = [not qualifier
+                     or any(part in county for part in qualifier)
+                     for qualifier, county in zip(found['qualifier'],
+                                                  found['county'])]
+        found = found[in_county]
+
+        # Of the places of the preferred type, a single one is a match
+        best = found.groupby('Parish')['rank'].transform('min')
+        found = found[found['rank'] == best]
+        found = found[~found['Parish'].duplicated(keep=False)]
+
+        return found.reset_index(drop=True)
+
+
+class SeleniumGeocoder(Geocoder):
+    """Look parishes up on gridreferencefinder.com by driving Chrome.
+
+    Requires selenium and chromedriver, and a network connection.
+    """
+
+    batch_size = 50
+    rate = 0.2
+
+    def _geocode(self, parishes):
+        # Imported here so other geocoders work without selenium installed
+        from migration.utils.get_locs import selenium_lookup
+
+        return selenium_lookup(parishes)
+
+
+class GeocodeRunner:
+    """Geocode the parishes missing from a location store, concurrently.
+
+    Parishes already in store (found or not) are never looked up again.
+    The rest are split into batches of batch_size and geocoded on workers
+    threads, starting at most rate batches a second. A batch which fails
+    is retried up to retries times, waiting backoff seconds and then
+    doubling the wait. Each batch is added to store as soon as it is
+    found, so an interrupted run keeps what it found.
+    """
+
+    def __init__(self, geocoder, store, batch_size=None, workers=4,
+                 rate=None, retries=3, backoff=1.0):
+        self.geocoder = geocoder
+        self.store = store
+        self.batch_size = batch_size or geocoder.batch_size
+        self.workers = workers
+        self.rate = rate or geocoder.rate
+        self.retries = retries
+        self.backoff = backoff
+
+        self.__lock = threading.Lock()
+        self.__next_start = 0.0
+
+    def run(self, parishes):
+        """Geocode those of parishes missing from the store.
+
+        Returns the number of parishes looked up. Batches which fail every
+        retry are reported and left missing, to be tried on the next run.
+        """
+        missing = self.store.missing(np.unique(parishes))
+        if not len(missing):
+            return 0
+
+        size = self.batch_size or len(missing)
+        batches = [missing[i:i + size] for i in range(0, len(missing), size)]
+
+        if len(batches) == 1 or self.workers == 1:
+            results = ((batch, self.__attempt(batch)) for batch in batches)
+            failed = self.__store(results)
+        else:
+            with ThreadPoolExecutor(self.workers) as pool:
+                futures = {pool.submit(self.__attempt, batch): batch
+                           for batch in batches}
+                results = ((futures[future], future.result())
+                           for future in as_completed(futures))
+                failed = self.__store(results)
+
+        if failed:
+            print('{} of {} parishes could not be geocoded:'.format(
+                sum(len(batch) for batch, _ in failed), len(missing)))
+            for batch, error in failed:
+                print('  {}: {}'.format(', '.join(batch), error))
+
+        return len(missing)
+
+    def __store(self, results):
+        """Store each batch's locations, in this thread, as they arrive."""
+        failed = []
+        for batch, (df, error) in results:
+            if error is None:
+                self.store.add(df)
+            else:
+                failed.append((batch, error))
+
+        return failed
+
+    def __attempt(self, batch):
+        """Geocode batch, retrying on failure. Returns (df, error)."""
+        wait = self.backoff
+        for attempt in range(self.retries + 1):
+            self.__throttle()
+            try:
+                return self.geocoder.geocode(batch), None
+            except Exception as error:
+                if attempt == self.retries:
+                    return None, repr(error)
+            time.sleep(wait)
+            wait *= 2
+
+    def __throttle(self):
+        """Wait until the next batch may start, under the rate limit."""
+        if not self.rate:
+            return
+
+        with self.__lock:
+            now = time.monotonic()
+            start = max(now, self.__next_start)
+            self.__next_start = start + 1 / self.rate
+
+        time.sleep(start - now)
+
+
+def default_geocoder(gazetteer=None):
+    """The default geocoder: the gazetteer at gazetteer (or the GAZETTEER
+    environment variable) if there is one, else the Selenium scraper."""
+    gazetteer = gazetteer or os.environ.get('GAZETTEER')
+
+    if gazetteer:
+        return GazetteerGeocoder(gazetteer)
+
+    return SeleniumGeocoder()
+
+
+def grid_to_latlon(easting, northing):
+    """Convert British National Grid coordinates to WGS84 latitude and
+    longitude (in degrees), vectorised over arrays."""
+    e = np.asarray(easting, dtype=float)
+    n = np.asarray(northing, dtype=float)
+
+    a, b = AIRY_A, AIRY_B
+    e2 = 1 - (b * b) / (a * a)
+    m_n = (a - b) / (a + b)
+
+    # Iterate for the latitude whose meridional arc matches the northing
+    lat = np.full_like(n, LAT0)
+    arc = np.zeros_like(n)
+    for _ in range(10):
+        lat = (n - N0 - arc) / (a * F0) + lat
+        arc = b * F0 * (
+            (1 + m_n + 5 / 4 * m_n ** 2 + 5 / 4 * m_n ** 3) * (lat - LAT0)
+            - (3 * m_n + 3 * m_n ** 2 + 21 / 8 * m_n ** 3)
+            * np.sin(lat - LAT0) * np.cos(lat + LAT0)
+            + (15 / 8 * m_n ** 2 + 15 / 8 * m_n ** 3)
+            * np.sin(2 * (lat - LAT0)) * np.cos(2 * (lat + LAT0))
+            - 35 / 24 * m_n ** 3
+            * np.sin(3 * (lat - LAT0)) * np.cos(3 * (lat + LAT0)))
+
+    sin_lat, cos_lat, tan_lat = np.sin(lat), np.cos(lat), np.tan(lat)
+    nu = a * F0 / np.sqrt(1 - e2 * sin_lat ** 2)
+    rho = a * F0 * (1 - e2) / (1 - e2 * sin_lat ** 2) ** 1.5
+    eta2 = nu / rho - 1
+
+    vii = tan_lat / (2 * rho * nu)
+    viii = tan_lat / (24 * rho * nu ** 3) * (
+        5 + 3 * tan_lat ** 2 + eta2 - 9 * tan_lat ** 2 * eta2)
+    ix = tan_lat / (720 * rho * nu ** 5) * (
+        61 + 90 * tan_lat ** 2 + 45 * tan_lat ** 4)
+    x = 1 / (cos_lat * nu)
+    xi = 1 / (cos_lat * 6 * nu ** 3) * (nu / rho + 2 * tan_lat ** 2)
+    xii = 1 / (cos_lat * 120 * nu ** 5) * (
+        5 + 28 * tan_lat ** 2 + 24 * tan_lat ** 4)
+    xiia = 1 / (cos_lat * 5040 * nu ** 7) * (
+        61 + 662 * tan_lat ** 2 + 1320 * tan_lat ** 4 + 720 * tan_lat ** 6)
+
+    d = e - E0
+    lat = lat - vii * d ** 2 + viii * d ** 4 - ix * d ** 6
+    lon = LON0 + x * d - xi * d ** 3 + xii * d ** 5 - xiia * d ** 7
+
+    return __osgb36_to_wgs84(lat, lon)
+
+
+def grid_reference(easting, northing, digits=6):
+    """Format British National Grid coordinates as grid references, e.g.
+    'NZ 123 456', vectorised over arrays."""
+    e = np.asarray(easting, dtype=float)
+    n = np.asarray(northing, dtype=float)
+    valid = (e >= 0) & (e < 700000) & (n >= 0) & (n < 1300000)
+
+    e = np.where(valid, e, 0).astype(int)
+    n = np.where(valid, n, 0).astype(int)
+
+    # Index of the 500km square, then of the 100km square within it
+    e100, n100 = e // 100000, n // 100000
+    l1 = (19 - n100) - (19 - n100) % 5 + (e100 + 10) // 5
+    l2 = (19 - n100) * 5 % 25 + e100 % 5
+
+    letters = np.array(list(GRID_LETTERS))
+    half = digits // 2
+    scale = 10 ** (5 - half)
+    refs = pd.Series(letters[l1]) + letters[l2] + ' ' \
+        + pd.Series(e % 100000 // scale).astype(str).str.zfill(half) + ' ' \
+        + pd.Series(n % 100000 // scale).astype(str).str.zfill(half)
+
+    return np.where(valid, refs.to_numpy(dtype=object), 'Not in UK')
+
+
+def __osgb36_to_wgs84(lat, lon):
+    """Shift OSGB36 latitudes and longitudes (radians) to WGS84 degrees."""
+    # To cartesian coordinates on the Airy ellipsoid
+    e2 = 1 - AIRY_B ** 2 / AIRY_A ** 2
+    nu = AIRY_A / np.sqrt(1 - e2 * np.sin(lat) ** 2)
+    xyz = np.stack([nu * np.cos(lat) * np.cos(lon),
+                    nu * np.cos(lat) * np.sin(lon),
+                    (1 - e2) * nu * np.sin(lat)])
+
+    # Helmert transform
+    rx, ry, rz = HELMERT_R
+    rotation = np.array([[1, -rz, ry],
+                         [rz, 1, -rx],
+                         [-ry, rx, 1]])
+    xyz = HELMERT_T[:, None] + (1 + HELMERT_S) * rotation @ xyz
+
+    # Back to latitude and longitude on the WGS84 ellipsoid
+    x, y, z = xyz
+    e2 = 1 - WGS84_B ** 2 / WGS84_A ** 2
+    p = np.sqrt(x ** 2 + y ** 2)
+    lat = np.arctan2(z, p * (1 - e2))
+    for _ in range(10):
+        nu = WGS84_A / np.sqrt(1 - e2 * np.sin(lat) ** 2)
+        lat = np.arctan2(z + e2 * nu * np.sin(lat), p)
+
+    return np.degrees(lat), np.degrees(np.arctan2(y, x))
@@ -8,6 +8,8 @@ import pandas as pd
 from selenium import webdriver
 from selenium.webdriver.common.keys import Keys
 
+from migration.utils.locations import place_name
+
 
 def selenium_lookup(parishes):
     """Look up the latitude and longitude of the parishes."""
@@ -86,9 +88,9 @@ def tidy_txt(txt):
 
 def fill_empties(df, parishes):
     """Add in locations which couldn't be found as NANs."""
-    # Boolean array which indicates whether an array was found or not
-    located = np.array([np.any(df.Title.str.contains(parish, regex=False))
-                        for parish in parishes])
+    # Boolean array which indicates whether a parish was found or not
+    parishes = np.asarray(parishes, dtype=object)
+    located = place_name(parishes).isin(place_name(df.Title)).to_numpy()
 
     # Extract the locations which couldn't be found
     df_lost = pd.DataFrame({'Title': parishes[~located]})
@@ -97,10 +99,9 @@ def fill_empties(df, parishes):
     for col in df.columns[1:]:
         df_lost[col] = np.nan
 
-    # Append missing parishes
-    df = df.append(df_lost, ignore_index=True)
-    # Sort alphabetically
-    df = df.sort_values('Title')
+    # Append missing parishes, keeping the order they were searched in
+    # (see Geocoder.geocode)
+    df = pd.concat([df, df_lost], ignore_index=True)
 
     return df
 
@@ -0,0 +1,227 @@
+#! /usr/bin/env python3
+
+"""
+Analyse the network of marriages between parishes as a sparse graph.
+
+Parishes are nodes, and each pair of (groom's parish, bride's parish) is a
+directed edge weighted by its number of marriages. The graph is held as a
+scipy.sparse adjacency matrix, and every measure is computed with sparse
+matrix operations, so the cost grows with the number of distinct pairs
+rather than with the square of the number of parishes.
+"""
+
+import os.path as path
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+
+from migration.utils.locations import normalise
+
+
+class MarriageGraph:
+    """Weighted graph of marriages between parishes.
+
+    pairs and counts are as returned by load_marriages(): the groom's and
+    bride's parish of each distinct pair, and its number of marriages.
+    Parishes are identified by their lookup key (see locations.normalise),
+    as they are when the network is plotted, so different spellings of the
+    same parish are one node, named by the first spelling listed.
+
+        .parishes    name of each node
+        .directed    adjacency from groom's parish (row) to bride's (column)
+        .undirected  marriages between each two parishes, either way round
+    """
+
+    def __init__(self, pairs, counts):
+        names = np.asarray(pairs, dtype=object).reshape(-1)
+        codes, keys = pd.factorize(normalise(names), sort=True)
+        codes = codes.reshape(-1, 2)
+
+        # The first spelling of each parish names it
+        first = np.unique(codes.ravel(), return_index=True)[1]
+        self.parishes = names[first]
+
+        n = len(self.parishes)
+        weights = np.asarray(counts, dtype=float)
+
+        # Repeated pairs are summed
+        self.directed = sparse.csr_matrix((weights,
+                                           (codes[:, 0], codes[:, 1])),
+                                          shape=(n, n))
+
+        # Marriages within a parish are counted once, not once each way
+        self.undirected = (self.directed + self.directed.T
+                           - sparse.diags(self.directed.diagonal())).tocsr()
+
+    def __len__(self):
+        return len(self.parishes)
+
+    def flows(self):
+        """Marriages by the groom's and by the bride's parish.
+
+        within counts marriages of two people of the same parish, and net
+        is grooms less brides.
+        """
+        grooms = np.asarray(self.directed.sum(axis=1)).ravel()
+        brides = np.asarray(self.directed.sum(axis=0)).ravel()
+
+        return pd.DataFrame({'grooms': grooms,
+                             'brides': brides,
+                             'within': self.directed.diagonal(),
+                             'net': grooms - brides},
+                            index=self.__index())
+
+    def degree(self):
+        """Number of other parishes each parish has marriages with."""
+        between = self.__between()
+        return pd.Series(np.diff(between.indptr), index=self.__index(),
+                         name='degree')
+
+    def strength(self):
+        """Number of marriages of each parish with other parishes."""
+        between = self.__between()
+        return pd.Series(np.asarray(between.sum(axis=1)).ravel(),
+                         index=self.__index(), name='strength')
+
+    def components(self):
+        """Label each parish with its connected component, largest first."""
+        _, labels = connected_components(self.undirected, directed=False)
+        return pd.Series(self.__by_size(labels), index=self.__index(),
+                         name='component')
+
+    def eigenvector_centrality(self, tol=1e-10, max_iter=1000):
+        """Eigenvector centrality of each parish, by marriages either way.
+
+        Found by power iteration on the sparse adjacency, shifted by the
+        identity so that it converges on bipartite graphs too. Marriages
+        within a parish are left out: they connect it to no other parish.
+        """
+        between = self.__between()
+        x = np.full(len(self), 1 / np.sqrt(max(len(self), 1)))
+
+        for _ in range(max_iter):
+            previous = x
+            x = between @ x + x
+            x /= np.linalg.norm(x) or 1
+
+            if np.abs(x - previous).sum() < tol * len(self):
+                break
+
+        return pd.Series(x, index=self.__index(), name='eigenvector')
+
+    def pagerank(self, damping=0.85, tol=1e-10, max_iter=1000):
+        """PageRank of each parish, following marriages from groom to bride."""
+        n = len(self)
+        if not n:
+            return pd.Series(np.zeros(0), index=self.__index(),
+                             name='pagerank')
+
+        out = np.asarray(self.directed.sum(axis=1)).ravel()
+
+        # Transition matrix, with parishes sending no brides left dangling
+        inverse = np.divide(1, out, out=np.zeros(n), where=out > 0)
+        transition = (sparse.diags(inverse) @ self.directed).T.tocsr()
+        dangling = out == 0
+
+        rank = np.full(n, 1 / max(n, 1))
+        for _ in range(max_iter):
+            previous = rank
+            rank = (damping * (transition @ rank + rank[dangling].sum() / n)
+                    + (1 - damping) / n)
+
+            if np.abs(rank - previous).sum() < tol * n:
+                break
+
+        return pd.Series(rank, index=self.__index(), name='pagerank')
+
+    def communities(self, max_iter=100, seed=0):
+        """Detect communities by weighted label propagation.
+
+        Each parish repeatedly takes the label carrying the most marriages
+        among its neighbours, until labels settle. Parishes are updated in
+        two random halves in turn, each with one sparse product, which
+        stops labels oscillating. Communities are numbered from 0, largest
+        first.
+        """
+        n = len(self)
+        if not n:
+            return pd.Series(np.zeros(0, dtype=int), index=self.__index(),
+                             name='community')
+
+        between = self.__between()
+        labels = np.arange(n)
+        rng = np.random.default_rng(seed)
+
+        for _ in range(max_iter):
+            changed = False
+
+            for half in np.array_split(rng.permutation(n), 2):
+                # Marriages of each parish with each label
+                one_hot = sparse.csr_matrix((np.ones(n), (np.arange(n),
+                                                          labels)),
+                                            shape=(n, n))
+                scores = (between[half] @ one_hot).tocsr()
+
+                # Parishes with no neighbours keep their own label
+                best = np.asarray(scores.argmax(axis=1)).ravel()
+                has_neighbours = np.diff(scores.indptr) > 0
+
+                # Keep the current label where it ties for best
+                current = np.asarray(
+                    scores[np.arange(len(half)), labels[half]]).ravel()
+                top = np.asarray(scores.max(axis=1).todense()).ravel()
+                update = has_neighbours & (current < top)
+
+                changed |= update.any()
+                labels[half[update]] = best[update]
+
+            if not changed:
+                break
+
+        return pd.Series(self.__by_size(labels), index=self.__index(),
+                         name='community')
+
+    def nodes(self):
+        """Table of every measure, one row per parish."""
+        return pd.concat([self.flows(),
+                          self.degree(),
+                          self.strength(),
+                          self.components(),
+                          self.communities(),
+                          self.eigenvector_centrality(),
+                          self.pagerank()], axis=1)
+
+    def edges(self):
+        """Table of marriages between each groom's and bride's parish."""
+        coo = self.directed.tocoo()
+        return pd.DataFrame({'Groom_Parish': self.parishes[coo.row],
+                             'Bride_Parish': self.parishes[coo.col],
+                             'Marriages': coo.data.astype(int)})
+
+    def to_csv(self, out_dir, name='marriage'):
+        """Write the node and edge tables to out_dir as CSV files."""
+        self.nodes().to_csv(path.join(out_dir, name + '_nodes.csv'))
+        self.edges().to_csv(path.join(out_dir, name + '_edges.csv'),
+                            index=False)
+
+    def __index(self):
+        return pd.Index(self.parishes, name='Parish')
+
+    def __between(self):
+        """Undirected adjacency without marriages within a parish."""
+        between = (self.undirected
+                   - sparse.diags(self.undirected.diagonal())).tocsr()
+        between.eliminate_zeros()
+        return between
+
+    @staticmethod
+    def __by_size(labels):
+        """Renumber labels from 0, the most common first."""
+        unique, inverse, sizes = np.unique(labels, return_inverse=True,
+                                           return_counts=True)
+        order = np.argsort(-sizes, kind='stable')
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        return rank[inverse]
@@ -0,0 +1,198 @@
+#! /usr/bin/env python3
+
+"""Store of parish locations, keyed by the normalised name they were asked for."""
+
+import os.path as path
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+# Columns of the lookup table, as exported by the map tool
+COLUMNS = ['Title', 'Grid Reference', 'Latitude', 'Longitude']
+
+# Outcome of looking up a parish
+FOUND = 'found'
+NOT_IN_UK = 'not in uk'
+NOT_FOUND = 'not found'
+
+
+def normalise(names):
+    """Normalise parish names to lookup keys.
+
+    Case and surrounding and repeated whitespace are ignored, and a
+    qualifier is kept whether it is given in parentheses or after a comma,
+    e.g. 'Newton (Durham)' and 'newton,  Durham' both become
+    'newton, durham', but 'Newton, Yorkshire' stays a different parish.
+    """
+    # Names repeat, so normalise each distinct name once
+    codes, unique = pd.factorize(np.asarray(names, dtype=object),
+                                 use_na_sentinel=False)
+    unique = pd.Series(unique, dtype=object)
+
+    # Write parenthesised qualifiers after a comma
+    unique = unique.astype(str).str.replace(r'\(([^)]*)\)', r',\1',
+                                            regex=True)
+
+    # Fold case and whitespace, separating qualifiers by a single ', '
+    unique = unique.str.casefold().str.replace(r'\s+', ' ', regex=True)
+    unique = unique.str.replace(r'\s*,[\s,]*', ', ', regex=True)
+    unique = unique.str.strip(' ,')
+
+    return pd.Series(unique.to_numpy()[codes], dtype=object)
+
+
+def place_name(names):
+    """Normalised names without their qualifiers, e.g. 'ryton' for both
+    'Ryton (Durham)' and 'ryton, Tyne and Wear'."""
+    return normalise(names).str.split(',').str[0]
+
+
+def match_titles(parishes, df, ordered=True):
+    """The rows of df found for each of parishes, with a Parish column.
+
+    Geocoders title places as they know them (e.g. 'Ryton, Tyne and Wear'
+    for 'Ryton'), so rows are matched to parishes on place name. If ordered,
+    df lists places in the order parishes were asked for, and the nth
+    parish of a place name takes the nth row of it; otherwise only place
+    names with a single parish and a single row are matched. Parishes
+    without a match are left out.
+    """
+    parishes = pd.DataFrame({'Parish': np.asarray(parishes, dtype=object)})
+    parishes['place'] = place_name(parishes['Parish']).to_numpy()
+    rows = df.drop(columns='Parish', errors='ignore')
+    rows = rows.assign(place=place_name(rows['Title']).to_numpy())
+
+    if ordered:
+        parishes['n'] = parishes.groupby('place').cumcount()
+        rows['n'] = rows.groupby('place').cumcount()
+    else:
+        # Matching in any other way could swap two places of the same name
+        parishes = parishes[~parishes['place'].duplicated(keep=False)]
+        rows = rows[~rows['place'].duplicated(keep=False)]
+        parishes = parishes.assign(n=0)
+        rows = rows.assign(n=0)
+
+    matched = parishes.merge(rows, on=['place', 'n'])
+    return matched.drop(columns=['place', 'n'])
+
+
+def status(df):
+    """The outcome of looking up each location in df."""
+    missing = df['Latitude'].isna() | df['Longitude'].isna()
+    not_in_uk = df['Grid Reference'] == 'Not in UK'
+
+    return pd.Series(np.select([not_in_uk, missing], [NOT_IN_UK, NOT_FOUND],
+                               FOUND),
+                     index=df.index)
+
+
+class LocationStore:
+    """SQLite store of the locations of parishes, keyed by normalised name.
+
+    Each location is keyed on the name of the parish it was looked up for
+    (see normalise()), qualifier and all, rather than on the title the
+    geocoder found it under. Parishes which could not be located are stored
+    too, with their status (see status()), so they are never looked up
+    again.
+    """
+
+    def __init__(self, file_path=None):
+        if file_path is None:
+            file_path = path.join(
+                            path.dirname(
+                                path.dirname(
+                                    path.realpath(__file__))),
+                            'output',
+                            'parish_locations.sqlite')
+
+        self.file_path = file_path
+        self.conn = sqlite3.connect(file_path)
+
+        with self.conn:
+            # Stores keyed before qualifiers were kept may have merged
+            # parishes of the same name, so are started afresh
+            columns = [row[1] for row in self.conn.execute(
+                           'pragma table_info(locations)')]
+            if columns and 'parish' not in columns:
+                self.conn.execute('drop table locations')
+
+            self.conn.execute('create table if not exists locations '
+                              '(key text primary key, '
+                              'parish text, '
+                              'title text, '
+                              'grid_reference text, '
+                              'latitude real, '
+                              'longitude real, '
+                              'status text not null)')
+
+    def __len__(self):
+        count = self.conn.execute('select count(*) from locations')
+        return count.fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+    def add(self, df):
+        """Add (or replace) the locations in df, in a single transaction.
+
+        df has the columns of the map tool's export (see COLUMNS), with
+        missing coordinates for parishes which could not be found, and a
+        Parish column of the name each was looked up for (as returned by
+        Geocoder.geocode()). Without one, rows are keyed on their Title.
+        """
+        # Coordinates are exported as text
+        df = df.assign(Latitude=pd.to_numeric(df['Latitude'], errors='coerce'),
+                       Longitude=pd.to_numeric(df['Longitude'],
+                                               errors='coerce'))
+        if 'Parish' not in df.columns:
+            df = df.assign(Parish=df['Title'])
+        df = df.assign(key=normalise(df['Parish']).to_numpy(),
+                       status=status(df).to_numpy())
+        df = df.drop_duplicates('key', keep='last')
+
+        rows = df[['key', 'Parish'] + COLUMNS + ['status']].astype(object)
+        rows = rows.where(rows.notna(), None)
+
+        # Either every row is written or none is
+        with self.conn:
+            self.conn.executemany('insert or replace into locations '
+                                  'values (?, ?, ?, ?, ?, ?, ?)',
+                                  rows.itertuples(index=False, name=None))
+
+    def missing(self, parishes):
+        """Those of parishes which have never been looked up."""
+        parishes = np.asarray(parishes, dtype=object)
+        known = pd.read_sql('select key from locations', self.conn)['key']
+
+        return parishes[~normalise(parishes).isin(known).to_numpy()]
+
+    def lookup(self, parishes, located=True):
+        """The stored locations of parishes, by exact key.
+
+        With located=True only parishes found within the UK are returned.
+        The Parish column gives the name each location was looked up by.
+        """
+        keys = pd.DataFrame({'Parish': np.asarray(parishes, dtype=object)})
+        keys['key'] = normalise(keys['Parish']).to_numpy()
+
+        # Join on the key in SQLite, rather than scanning the store
+        with self.conn:
+            self.conn.execute('create temp table if not exists wanted '
+                              '(key text, parish text)')
+            self.conn.execute('delete from wanted')
+            self.conn.executemany('insert into wanted values (?, ?)',
+                                  keys[['key', 'Parish']].itertuples(
+                                      index=False, name=None))
+
+        query = ('select wanted.parish as "Parish", '
+                 'title as "Title", '
+                 'grid_reference as "Grid Reference", '
+                 'latitude as "Latitude", '
+                 'longitude as "Longitude", '
+                 'status as "Status" '
+                 'from wanted join locations using (key)')
+        if located:
+            query += " where status = '{}'".format(FOUND)
+
+        return pd.read_sql(query + ' order by title', self.conn)
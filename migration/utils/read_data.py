@@ -8,7 +8,8 @@ import os
 import os.path as path
 import re
 
-from migration.utils.get_locs import selenium_lookup
+from migration.utils.geocode import GeocodeRunner, default_geocoder
+from migration.utils.locations import LocationStore, match_titles
 
 
 def read_excel(file_name, **kwargs):
@@ -43,7 +44,7 @@ def load_population():
 def load_marriages():
     """Load and prep marriage data."""
     # Load data
-    data = read_excel('Marriage_Migration', {'sheet_name': None})
+    data = read_excel('Marriage_Migration', sheet_name=None)
 
     # Tidy data
     data = tidy_marriages(data)
@@ -57,6 +58,36 @@ def load_marriages():
     return pairs, counts, locations
 
 
+def load_marriages_by_sheet():
+    """Load and prep marriage data, counting pairs separately per sheet.
+
+    Each sheet of the spreadsheet (e.g. a period of the register) is taken
+    as the period of the marriages listed on it. Returns the pairs, their
+    counts and their sheet, and the locations of every parish.
+    """
+    # Load data
+    data = read_excel('Marriage_Migration', sheet_name=None)
+
+    # Tidy each sheet separately, keeping its name
+    records = []
+    for sheet, values in data.items():
+        pairs = pd.DataFrame(tidy_marriages({sheet: values}),
+                             columns=['Groom_Parish', 'Bride_Parish'])
+        records.append(pairs.assign(Sheet=sheet))
+    records = pd.concat(records, ignore_index=True)
+
+    # Count occurances of pairs on each sheet
+    counts = records.groupby(['Sheet', 'Groom_Parish', 'Bride_Parish'],
+                             sort=False).size()
+    pairs = counts.index.droplevel('Sheet').to_frame().to_numpy()
+    sheets = counts.index.get_level_values('Sheet').to_numpy()
+
+    # Get locations
+    locations = lookup_locs(pairs)
+
+    return pairs, counts.to_numpy(), sheets, locations
+
+
 def load_tax():
     """Load tax data."""
     df = read_excel('Rate_Payers_Excel.xlsx')
@@ -90,8 +121,14 @@ def tidy_marriages(data):
     return np.vstack([np.array(x), np.array(y)]).T
 
 
-def lookup_locs(data):
-    """Get location data for each parish."""
+def lookup_locs(data, geocoder=None, **runner_kwargs):
+    """Get location data for each parish.
+
+    Parishes not already in the location store are found by geocoder (by
+    default the gazetteer named by $GAZETTEER, else the Selenium scraper),
+    in batches. runner_kwargs (e.g. workers, rate) are passed to the
+    GeocodeRunner.
+    """
     # Get list of parishes referenced
     parishes = np.unique(data)
 
@@ -102,42 +139,24 @@ def lookup_locs(data):
                           path.realpath(__file__))),
                   'output')
 
-    # Construct path to lookup table
-    path_to_table = path.join(out_dir, 'parish_locations.xlsx')
-
-    # If lookup table does not exist
-    if not path.isfile(path_to_table):
-        # Perform lookup 
-        df = selenium_lookup(parishes)
-        # Write lookup table
-        df.to_excel(path_to_table)
-    else:
-        # Read in current lookup table
-        df = pd.read_excel(path_to_table, index_col=0)
-
-        # Construct boolean indicating which parishes already exist in lookup
-        # regex drops problems with titles which include parentheses
-        located = np.array([np.any(df.Title.str.contains(parish, regex=False))
-                            for parish in parishes])
-
-        # Lookup parishes not already listed
-        if len(parishes[~located]) >0:
-            # New entries
-            new_locs = selenium_lookup(parishes[~located])
-
-            # Append new entries
-            df = df.append(new_locs, ignore_index=True)
-            # Sort alphabetically
-            df = df.sort_values('Title')
-
-            # Write lookup table
-            df.to_excel(path_to_table)
-
-    # Drop locations outside UK
-    df.drop(df.index[df['Grid Reference'] == 'Not in UK'], inplace=True)
-
-    # Drop locations with missing longitude or latitude
-    df.drop(df.index[df.Longitude.isna() | df.Latitude.isna()], inplace=True)
-
-    return df
-
+    store = LocationStore(path.join(out_dir, 'parish_locations.sqlite'))
+
+    try:
+        # Seed the store from the lookup table it replaces. Its titles are
+        # the map tool's, in no particular order, so only places with one
+        # title and one parish of that name are known to be the same
+        path_to_table = path.join(out_dir, 'parish_locations.xlsx')
+        if not len(store) and path.isfile(path_to_table):
+            table = pd.read_excel(path_to_table, index_col=0)
+            store.add(match_titles(parishes, table, ordered=False))
+
+        # Lookup parishes not already stored, found or not
+        if len(store.missing(parishes)) > 0:
+            if geocoder is None:
+                geocoder = default_geocoder()
+            GeocodeRunner(geocoder, store, **runner_kwargs).run(parishes)
+
+        # Locations found within the UK, with coordinates
+        return store.lookup(parishes)
+    finally:
+        store.close()